@@ -0,0 +1,102 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+"""
+Compares the cost of handling status messages in
+:meth:`SocketConnector._message_received <score.cruise.service.SocketConnector>`
+with the former approach of decoding every message to `str` and parsing it
+with :mod:`json`. Monitors repeat their status often, so a configurable
+fraction of the messages is identical to the previous one. The throughput
+is reported in messages per CPU second, i.e. per core.
+
+    python benchmarks/decode.py [--messages N] [--duplicates FRACTION]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict
+
+from score.cruise.service import SocketConnector, json_backend
+
+
+class DecodeAllConnector(SocketConnector):
+    """
+    A connector decoding every single message, like it used to.
+    """
+
+    def _message_received(self, message):
+        self.status_received = self.loop.time()
+        self._status_change(json.loads(
+            str(message, 'UTF-8'), object_pairs_hook=OrderedDict))
+
+
+def make_messages(count, services, duplicates):
+    messages = []
+    state = 0
+    for _ in range(count):
+        if not messages or random.random() >= duplicates:
+            state += 1
+        status = dict(('service-%d' % j, ('running', 'paused')[state % 2])
+                      for j in range(services))
+        messages.append(json.dumps(status).encode('UTF-8'))
+    return messages
+
+
+def measure(factory, messages):
+    loop = asyncio.new_event_loop()
+    try:
+        connector = factory('benchmark', loop, None, None)
+        start = time.process_time()
+        for message in messages:
+            connector._message_received(message)
+        return time.process_time() - start
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=100000,
+                        help='number of messages')
+    parser.add_argument('--services', type=int, default=20,
+                        help='services per status message')
+    parser.add_argument('--duplicates', type=float, default=.9,
+                        help='fraction of messages identical to the previous '
+                        'one')
+    args = parser.parse_args()
+    random.seed(0)
+    messages = make_messages(args.messages, args.services, args.duplicates)
+    for name, factory in (('decode all', DecodeAllConnector),
+                          ('current (%s)' % json_backend, SocketConnector)):
+        duration = measure(factory, messages)
+        print('%-16s %8d messages %8.3fs CPU %10.0f messages/s/core' % (
+            name, len(messages), duration, len(messages) / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+"""
+Measures how many status changes per second a connector can dispatch to its
+callbacks, with callbacks that are plain functions, native coroutines, or
+generator-based coroutines as produced by the former ``@asyncio.coroutine``
+decorator. Native coroutines receive their statuses through a bounded queue
+with the given overflow *policy*, the number of statuses dropped due to a
+full queue is reported as well.
+
+    python benchmarks/dispatch.py [--messages N] [--callbacks N]
+                                  [--engine auto|asyncio|uvloop]
+                                  [--policy block|drop-oldest|coalesce]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import types
+
+from score.cruise._init import new_event_loop
+from score.cruise.service import SocketConnector
+
+
+def make_messages(messages, services):
+    result = []
+    for i in range(messages):
+        state = ('running', 'paused')[i % 2]
+        status = dict(('service-%d' % j, state) for j in range(services))
+        result.append(json.dumps(status).encode('UTF-8'))
+    return result
+
+
+def function_callback(counter):
+    def callback(status):
+        counter[0] += 1
+    return callback
+
+
+def native_callback(counter):
+    async def callback(status):
+        counter[0] += 1
+    return callback
+
+
+def generator_callback(counter):
+    @types.coroutine
+    def callback(status):
+        counter[0] += 1
+        if False:
+            yield
+    return callback
+
+
+async def measure(messages, callback_factory, callbacks, **kwargs):
+    loop = asyncio.get_running_loop()
+    connector = SocketConnector('benchmark', loop, None, None)
+    hub = connector.status_hub
+    counter = [0]
+    for _ in range(callbacks):
+        # bypassing add_status_change_callback(), which would connect
+        hub.subscribe(callback_factory(counter), **kwargs)
+    expected = len(messages) * callbacks
+    start = time.perf_counter()
+    for message in messages:
+        connector._message_received(message)
+    while counter[0] + hub.dropped < expected:
+        await asyncio.sleep(0)
+    return time.perf_counter() - start, hub.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='status changes to dispatch')
+    parser.add_argument('--callbacks', type=int, default=5,
+                        help='callbacks registered on the connector')
+    parser.add_argument('--services', type=int, default=10,
+                        help='services per status message')
+    parser.add_argument('--engine', default='auto',
+                        choices=('auto', 'asyncio', 'uvloop'),
+                        help='event loop implementation')
+    parser.add_argument('--policy', default='block',
+                        choices=('block', 'drop-oldest', 'coalesce'),
+                        help='overflow policy of the subscriber queues')
+    parser.add_argument('--maxsize', type=int, default=100,
+                        help='size of the subscriber queues')
+    args = parser.parse_args()
+    messages = make_messages(args.messages, args.services)
+    modes = [('function', function_callback), ('native', native_callback)]
+    if asyncio.iscoroutine(generator_callback([0])(None)):
+        modes.append(('generator', generator_callback))
+    for name, factory in modes:
+        loop, engine = new_event_loop(args.engine)
+        try:
+            duration, dropped = loop.run_until_complete(measure(
+                messages, factory, args.callbacks,
+                maxsize=args.maxsize, policy=args.policy))
+        finally:
+            loop.close()
+        print('%-8s %-10s %8d changes %8.3fs %10.0f changes/s %8d dropped' % (
+            engine, name, len(messages), duration, len(messages) / duration,
+            dropped))
+
+
+if __name__ == '__main__':
+    main()
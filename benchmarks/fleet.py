@@ -0,0 +1,210 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+"""
+A fleet of simulated ``score.serve`` monitors for benchmarks. The monitors
+speak the same newline-delimited JSON protocol as the real ones, but run in
+a child process, so they do not compete with the benchmarked connectors
+for the CPU.
+
+Every status message contains the additional service ``_sent`` with the
+time the message was written, which allows measuring the latency until a
+status change callback receives it.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import socket
+import time
+from collections import OrderedDict
+
+
+class SimulatedMonitor(asyncio.Protocol):
+    """
+    The connection of a client to a simulated monitor, which sends
+    :attr:`Fleet.messages` to the client and closes the connection after
+    *drop_after* messages, if given.
+    """
+
+    def __init__(self, fleet, drop_after=None):
+        self.fleet = fleet
+        self.drop_after = drop_after
+        self.transport = None
+        self.sent = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.fleet.clients.add(self)
+        self.send(self.fleet.message(time.time()))
+
+    def connection_lost(self, exc):
+        self.fleet.clients.discard(self)
+
+    def data_received(self, data):
+        # commands are ignored
+        pass
+
+    def send(self, message):
+        self.transport.write(message)
+        self.sent += 1
+        if self.drop_after and self.sent >= self.drop_after:
+            self.transport.close()
+
+
+class _FleetProcess:
+    """
+    The part of a :class:`Fleet` running in the child process.
+    """
+
+    def __init__(self, connection, servers, refused, services, size,
+                 drop_after):
+        self.connection = connection
+        self.servers = servers
+        self.refused = refused
+        self.drop_after = drop_after
+        self.clients = set()
+        self.state = 0
+        names = ['service-%d' % i for i in range(services)]
+        padding = max(0, size - len(json.dumps(dict.fromkeys(
+            names, 'running')))) // max(1, services)
+        self.names = [name + '-' * padding for name in names]
+
+    def message(self, timestamp):
+        status = OrderedDict.fromkeys(
+            self.names, ('running', 'paused')[self.state % 2])
+        status['_sent'] = '%.6f' % timestamp
+        return json.dumps(status).encode('UTF-8') + b'\n'
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        ports = []
+        for _ in range(self.servers):
+            server = loop.run_until_complete(loop.create_server(
+                lambda: SimulatedMonitor(self, self.drop_after),
+                '127.0.0.1', 0, backlog=1024))
+            ports.append(server.sockets[0].getsockname()[1])
+        for _ in range(self.refused):
+            ports.append(_free_port())
+        self.connection.send(ports)
+        loop.add_reader(self.connection.fileno(), self._command, loop)
+        loop.run_forever()
+
+    def _command(self, loop):
+        command, *args = self.connection.recv()
+        if command == 'emit':
+            loop.create_task(self._emit(loop, *args))
+        elif command == 'stop':
+            loop.stop()
+
+    async def _emit(self, loop, rate, duration):
+        """
+        Changes the state of all services *rate* times per second for
+        *duration* seconds and reports the number of messages sent.
+        """
+        start = loop.time()
+        sent = changes = 0
+        while True:
+            elapsed = loop.time() - start
+            if elapsed >= duration:
+                break
+            while changes < int(elapsed * rate):
+                changes += 1
+                self.state += 1
+                message = self.message(time.time())
+                for client in list(self.clients):
+                    client.send(message)
+                    sent += 1
+            await asyncio.sleep(min(1 / rate, .01))
+        self.connection.send(sent)
+
+
+def _free_port():
+    """
+    Returns a port that nobody listens on, connections to which will be
+    refused.
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class Fleet:
+    """
+    Runs *servers* simulated monitors with *services* services each in a
+    child process, along with *refused* ports refusing all connections.
+    Every status message is padded to roughly *size* bytes and the monitors
+    close each connection after *drop_after* messages, if given.
+    """
+
+    def __init__(self, servers, *, refused=0, services=10, size=0,
+                 drop_after=None):
+        self.servers = servers
+        self.refused = refused
+        self.services = services
+        self.size = size
+        self.drop_after = drop_after
+        self.ports = []
+        self._connection = None
+        self._process = None
+
+    def start(self):
+        self._connection, child = multiprocessing.Pipe()
+        fleet = _FleetProcess(child, self.servers, self.refused,
+                              self.services, self.size, self.drop_after)
+        self._process = multiprocessing.Process(target=fleet.run, daemon=True)
+        self._process.start()
+        self.ports = self._connection.recv()
+        return self.ports
+
+    async def emit(self, rate, duration):
+        """
+        Lets every monitor change its status *rate* times per second for
+        *duration* seconds. Returns the number of messages sent, once the
+        monitors are done.
+        """
+        self._connection.send(('emit', rate, duration))
+        return (await asyncio.get_running_loop().run_in_executor(
+            None, self._connection.recv))
+
+    def stop(self):
+        self._connection.send(('stop',))
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def conf(self, **overrides):
+        """
+        Returns the configuration for :func:`score.cruise.init` with one
+        server per port of this fleet.
+        """
+        conf = OrderedDict(
+            ('server.sim%d.monitor' % i, '127.0.0.1:%d' % port)
+            for i, port in enumerate(self.ports))
+        conf.update(overrides)
+        return conf
@@ -0,0 +1,109 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+Compares the throughput of :class:`score.cruise.service.ServeProtocol` with
+the naive line framing it replaced, by feeding both the same burst of status
+messages in chunks of the size a transport would deliver.
+
+    python benchmarks/framing.py [--size MEGABYTES] [--chunk BYTES]
+"""
+
+import argparse
+import json
+import time
+
+from score.cruise.service import ServeProtocol
+
+
+class NaiveProtocol:
+    """
+    The line framing ServeProtocol used to implement: the buffer is
+    re-created on every call and after every message.
+    """
+
+    def __init__(self, connector):
+        self.connector = connector
+        self.buffer = b''
+
+    def data_received(self, data):
+        self.buffer += data
+        index = self.buffer.find(b'\n')
+        while index >= 0:
+            message = self.buffer[:index]
+            self.buffer = self.buffer[index + 1:]
+            self.connector._message_received(str(message, 'UTF-8'))
+            index = self.buffer.find(b'\n')
+
+
+class CountingConnector:
+
+    name = 'benchmark'
+    loop = None
+
+    def __init__(self):
+        self.messages = 0
+
+    def _message_received(self, message):
+        self.messages += 1
+
+
+def make_burst(size, services):
+    status = json.dumps(dict(
+        ('service-%d' % i, 'running') for i in range(services)))
+    line = status.encode('UTF-8') + b'\n'
+    return line * (size // len(line) + 1)
+
+
+def measure(protocol_factory, burst, chunk_size):
+    connector = CountingConnector()
+    protocol = protocol_factory(connector)
+    start = time.perf_counter()
+    for offset in range(0, len(burst), chunk_size):
+        protocol.data_received(burst[offset:offset + chunk_size])
+    return time.perf_counter() - start, connector.messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=float, default=4,
+                        help='size of the burst in megabytes')
+    parser.add_argument('--chunk', type=int, default=65536,
+                        help='bytes per data_received() call')
+    parser.add_argument('--services', type=int, default=20,
+                        help='services per status message')
+    args = parser.parse_args()
+    burst = make_burst(int(args.size * 1024 * 1024), args.services)
+    megabytes = len(burst) / 1024 / 1024
+    for name, factory in (('naive', NaiveProtocol),
+                          ('ServeProtocol', ServeProtocol)):
+        duration, messages = measure(factory, burst, args.chunk)
+        print('%-14s %8d messages %8.3fs %8.1f MB/s' % (
+            name, messages, duration, megabytes / duration))
+
+
+if __name__ == '__main__':
+    main()
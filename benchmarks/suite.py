@@ -0,0 +1,231 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+"""
+Runs a set of benchmarks against a :class:`fleet.Fleet` of simulated
+monitors and prints the results as a JSON object, to be compared across
+releases:
+
+- ``connect_storm``: time until all servers reported their first status
+  after subscribing to all of them at once,
+- ``throughput`` and ``latency``: messages received per second (of wall
+  time and of CPU time, i.e. per core) and the time from writing a message
+  until a status change callback received it, while every monitor changes
+  its status *rate* times per second. The latency percentiles and maximum
+  are given in milliseconds (``p50_ms``, ``p90_ms``, ``p99_ms``,
+  ``max_ms``),
+- ``list``: wall time of initializing the module and querying all statuses,
+  which is what ``cruise list`` does,
+- ``memory``: memory allocated per connected connector, as measured by
+  :mod:`tracemalloc`.
+
+    python benchmarks/suite.py [--servers N] [--rate N] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from score.cruise import init
+from score.cruise.service import json_backend
+
+from fleet import Fleet
+
+
+async def subscribe_all(cruise, callback=None, timeout=60):
+    """
+    Subscribes to all servers of *cruise* and returns the number of seconds
+    until all of them reported a status.
+    """
+    pending = set(cruise.servers)
+    done = cruise.loop.create_future()
+
+    def status_changed(server, status):
+        pending.discard(server)
+        if not pending and not done.done():
+            done.set_result(None)
+        if callback is not None:
+            callback(server, status)
+    start = time.perf_counter()
+    for server in cruise.servers:
+        server.add_status_change_callback(
+            functools.partial(status_changed, server))
+    await asyncio.wait_for(done, timeout)
+    return time.perf_counter() - start
+
+
+async def disconnect_all(cruise):
+    for server in cruise.servers:
+        for subscription in list(server.status_hub.subscriptions):
+            server.remove_status_change_callback(subscription.callback)
+        if server.connected:
+            server._connection.close()
+    await asyncio.sleep(.1)
+
+
+async def storm_and_throughput(cruise, fleet, rate, duration):
+    received = [0]
+    latencies = []
+
+    def status_changed(server, status):
+        if isinstance(status, str):
+            return
+        received[0] += 1
+        latencies.append(time.time() - float(status['_sent']))
+    storm = await subscribe_all(cruise, status_changed)
+    results = {
+        'connect_storm': {
+            'seconds': storm,
+            'connected': sum(1 for s in cruise.servers if s.connected),
+            'offline': sum(1 for s in cruise.servers if s.status == 'offline'),
+        },
+    }
+    received[0] = 0
+    del latencies[:]
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    sent = await fleet.emit(rate, duration)
+    deadline = time.perf_counter() + 5
+    while received[0] < sent and time.perf_counter() < deadline:
+        await asyncio.sleep(.01)
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    results['throughput'] = {
+        'sent': sent,
+        'received': received[0],
+        'seconds': seconds,
+        'messages_per_second': received[0] / seconds,
+        'cpu_seconds': cpu_seconds,
+        'messages_per_cpu_second': received[0] / cpu_seconds,
+        'reconnects': sum(getattr(s, 'reconnects', 0) for s in cruise.servers),
+    }
+    latencies.sort()
+    if latencies:
+        results['latency'] = dict(
+            ('p%d_ms' % p, latencies[min(len(latencies) - 1,
+                                      len(latencies) * p // 100)] * 1000)
+            for p in (50, 90, 99))
+        results['latency']['max_ms'] = latencies[-1] * 1000
+    await disconnect_all(cruise)
+    return results
+
+
+def list_statuses(conf):
+    start = time.perf_counter()
+    cruise = init(conf)
+    statuses = cruise.run(cruise.get_statuses())
+    seconds = time.perf_counter() - start
+    cruise.run(disconnect_all(cruise))
+    cruise.loop.close()
+    values = list(statuses.values())
+    return {
+        'seconds': seconds,
+        'timeout': values.count('timeout'),
+        'offline': values.count('offline'),
+    }
+
+
+def memory(conf, servers):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cruise = init(conf)
+    cruise.run(subscribe_all(cruise))
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    cruise.run(disconnect_all(cruise))
+    cruise.loop.close()
+    return {
+        'bytes': allocated,
+        'bytes_per_connector': allocated / servers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--servers', type=int, default=200,
+                        help='number of simulated monitors')
+    parser.add_argument('--refused', type=int, default=0,
+                        help='number of additional servers refusing all '
+                        'connections')
+    parser.add_argument('--services', type=int, default=10,
+                        help='services per monitor')
+    parser.add_argument('--size', type=int, default=0,
+                        help='minimum size of a status message in bytes')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='status changes per monitor and second')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds to emit status changes')
+    parser.add_argument('--drop-after', type=int,
+                        help='close each connection after this many '
+                        'messages')
+    parser.add_argument('--engine', default='auto',
+                        choices=('auto', 'asyncio', 'uvloop'),
+                        help='event loop implementation')
+    parser.add_argument('--reconnect-concurrency', type=int, default=20,
+                        help='maximum number of connection attempts at once')
+    parser.add_argument('--output', help='file to write the results to')
+    args = parser.parse_args()
+    fleet = Fleet(args.servers, refused=args.refused, services=args.services,
+                  size=args.size, drop_after=args.drop_after)
+    fleet.start()
+    conf = fleet.conf(**{
+        'engine': args.engine,
+        'history.size': 0,
+        'reconnect.concurrency': args.reconnect_concurrency,
+    })
+    total = args.servers + args.refused
+    try:
+        cruise = init(conf)
+        results = cruise.run(storm_and_throughput(
+            cruise, fleet, args.rate, args.duration))
+        cruise.loop.close()
+        results['list'] = list_statuses(conf)
+        results['memory'] = memory(conf, total)
+    finally:
+        fleet.stop()
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'engine': cruise.engine,
+        'json_backend': json_backend,
+        'parameters': vars(args),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+"""
+Compares the status fan-in over TCP on the loopback interface with unix
+domain sockets: a number of fake monitors send a burst of status changes
+each, which are received by one connector per monitor.
+
+    python benchmarks/transport.py [--servers N] [--messages N]
+                                   [--engine auto|asyncio|uvloop]
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import time
+
+from score.cruise._init import new_event_loop
+from score.cruise.service import SocketConnector, UnixSocketConnector
+
+
+def make_burst(messages, services):
+    lines = []
+    for i in range(messages):
+        state = ('running', 'paused')[i % 2]
+        status = dict(('service-%d' % j, state) for j in range(services))
+        lines.append(json.dumps(status).encode('UTF-8') + b'\n')
+    return b''.join(lines)
+
+
+async def send_burst(burst, handlers, reader, writer):
+    handlers.append(asyncio.current_task())
+    writer.write(burst)
+    await writer.drain()
+    # keep the connection open until the connector closes it
+    await reader.read()
+    writer.close()
+
+
+async def measure(loop, connectors, expected, handlers):
+    received = [0]
+    done = loop.create_future()
+
+    def status_changed(status):
+        if isinstance(status, str):
+            return
+        received[0] += 1
+        if received[0] == expected and not done.done():
+            done.set_result(None)
+    start = time.perf_counter()
+    for connector in connectors:
+        connector.add_status_change_callback(status_changed)
+    await done
+    duration = time.perf_counter() - start
+    for connector in connectors:
+        connector.remove_status_change_callback(status_changed)
+        connector._connection.close()
+    await asyncio.gather(*handlers)
+    del handlers[:]
+    return duration
+
+
+async def run(args, engine):
+    loop = asyncio.get_running_loop()
+    burst = make_burst(args.messages, args.services)
+    handlers = []
+    handler = functools.partial(send_burst, burst, handlers)
+    expected = args.servers * args.messages
+    path = os.path.join(tempfile.mkdtemp(), 'monitor.sock')
+    tcp_server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    port = tcp_server.sockets[0].getsockname()[1]
+    unix_server = await asyncio.start_unix_server(handler, path)
+    transports = (
+        ('tcp', lambda i: SocketConnector(
+            'tcp-%d' % i, loop, '127.0.0.1', port)),
+        ('unix', lambda i: UnixSocketConnector('unix-%d' % i, loop, path)),
+    )
+    try:
+        for name, factory in transports:
+            connectors = [factory(i) for i in range(args.servers)]
+            duration = await measure(loop, connectors, expected, handlers)
+            print('%-8s %-5s %8d messages %8.3fs %10.0f messages/s' % (
+                engine, name, expected, duration, expected / duration))
+    finally:
+        tcp_server.close()
+        unix_server.close()
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--servers', type=int, default=50,
+                        help='number of simulated monitors')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='status messages per monitor')
+    parser.add_argument('--services', type=int, default=10,
+                        help='services per status message')
+    parser.add_argument('--engine', default='auto',
+                        choices=('auto', 'asyncio', 'uvloop'),
+                        help='event loop implementation')
+    args = parser.parse_args()
+    loop, engine = new_event_loop(args.engine)
+    try:
+        loop.run_until_complete(run(args, engine))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
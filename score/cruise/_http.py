@@ -0,0 +1,274 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+A minimal HTTP/1.1 server for the read-only endpoints of this module, with
+just enough WebSocket support (:rfc:`6455`) to push text messages to
+clients.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import struct
+from collections import OrderedDict, namedtuple
+
+
+log = logging.getLogger('score.cruise')
+
+
+reasons = {
+    101: 'Switching Protocols',
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    426: 'Upgrade Required',
+}
+
+_websocket_guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+#: Requests with more header lines than this are rejected.
+max_headers = 100
+
+#: Requests whose request line and headers exceed this number of bytes in
+#: total are rejected.
+max_header_size = 16384
+
+
+Request = namedtuple('Request',
+                     ('method', 'path', 'headers', 'reader', 'writer'))
+
+
+class Response(namedtuple('Response', ('status', 'headers', 'body'))):
+
+    __slots__ = ()
+
+    def __new__(cls, status, headers=None, body=b''):
+        if headers is None:
+            headers = OrderedDict()
+        return super().__new__(cls, status, headers, body)
+
+
+async def serve(host, port, handler):
+    """
+    Starts listening on *host* and *port* and returns the
+    :class:`asyncio.Server`. Each request is passed to the *handler* as a
+    :class:`Request`. The handler must return a :class:`Response`, or `None`
+    if it took over the connection.
+    """
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader, writer)
+                if request is None:
+                    break
+                response = handler(request)
+                if asyncio.iscoroutine(response):
+                    response = await response
+                if response is None:
+                    return
+                _write_response(writer, request, response)
+                await writer.drain()
+                if request.headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            log.exception('Error handling HTTP request')
+        writer.close()
+
+    # the limit applies to single lines, _read_request() limits the total
+    return (await asyncio.start_server(
+        handle_connection, host, port, limit=max_header_size))
+
+
+async def _read_request(reader, writer):
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        size = len(line)
+        method, path, _ = str(line, 'ISO-8859-1').split()
+        headers = {}
+        count = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            size += len(line)
+            count += 1
+            if count > max_headers or size > max_header_size:
+                raise ValueError('Request headers too large')
+            name, _, value = str(line, 'ISO-8859-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+    except ValueError:
+        # also raised by readline() for lines exceeding the limit
+        _write_response(writer, None, Response(400))
+        return None
+    return Request(method, path, headers, reader, writer)
+
+
+def _write_response(writer, request, response):
+    headers = OrderedDict(response.headers)
+    if response.status != 304:
+        headers['Content-Length'] = str(len(response.body))
+    lines = ['HTTP/1.1 %d %s' % (response.status, reasons[response.status])]
+    lines.extend('%s: %s' % item for item in headers.items())
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    writer.write(head.encode('ISO-8859-1'))
+    if request is None or request.method != 'HEAD':
+        writer.write(response.body)
+
+
+def accept_websocket(request):
+    """
+    Completes the opening handshake of a WebSocket connection, if *request*
+    asks for one, and returns the :class:`WebSocket`. Returns `None`
+    otherwise, without writing anything.
+    """
+    key = request.headers.get('sec-websocket-key')
+    upgrade = request.headers.get('upgrade', '').lower()
+    if request.method != 'GET' or upgrade != 'websocket' or not key:
+        return None
+    accept = base64.b64encode(hashlib.sha1(
+        (key + _websocket_guid).encode('ASCII')).digest())
+    request.writer.write(
+        b'HTTP/1.1 101 Switching Protocols\r\n'
+        b'Upgrade: websocket\r\n'
+        b'Connection: Upgrade\r\n'
+        b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+    return WebSocket(request.reader, request.writer)
+
+
+class WebSocket:
+    """
+    The server side of a WebSocket connection established with
+    :func:`accept_websocket`. Messages from the client are limited to
+    *max_message_size* bytes, the connection is closed if a client exceeds
+    this limit.
+    """
+
+    def __init__(self, reader, writer, max_message_size=65536):
+        self.reader = reader
+        self.writer = writer
+        self.max_message_size = max_message_size
+        self.closed = False
+
+    def send(self, text):
+        """
+        Sends a text message, unless the connection was closed.
+        """
+        if not self.closed:
+            self.writer.write(_frame(0x1, text.encode('UTF-8')))
+
+    async def drain(self):
+        """
+        Waits until the messages sent so far were handed to the kernel, just
+        like :meth:`asyncio.StreamWriter.drain`.
+        """
+        await self.writer.drain()
+
+    async def receive(self):
+        """
+        Returns the next message of the client as a `str`, or `None` once the
+        connection was closed. Pings are answered automatically.
+        """
+        fragments = []
+        size = 0
+        try:
+            while not self.closed:
+                opcode, final, payload = await self._read_frame(size)
+                if payload is None:
+                    self.close(1009)
+                    break
+                if opcode == 0x8:
+                    self.close()
+                    break
+                if opcode == 0x9:
+                    self.writer.write(_frame(0xA, payload))
+                    continue
+                if opcode == 0xA:
+                    continue
+                fragments.append(payload)
+                size += len(payload)
+                if final:
+                    return str(b''.join(fragments), 'UTF-8', 'replace')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.closed = True
+            self.writer.close()
+        return None
+
+    async def _read_frame(self, received):
+        """
+        Reads a single frame and returns its opcode, its FIN bit and its
+        unmasked payload. The payload is `None`, if it would exceed the
+        *max_message_size* together with the *received* fragments.
+        """
+        read = self.reader.readexactly
+        head = await read(2)
+        length = head[1] & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', await read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await read(8))
+        if received + length > self.max_message_size:
+            return head[0] & 0x0f, True, None
+        mask = await read(4) if head[1] & 0x80 else None
+        payload = await read(length)
+        if mask and length:
+            key = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, 'big') ^
+                       int.from_bytes(key, 'big')).to_bytes(length, 'big')
+        return head[0] & 0x0f, bool(head[0] & 0x80), payload
+
+    def close(self, code=1000):
+        """
+        Sends a close frame with given status *code* and closes the
+        connection.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.writer.write(_frame(0x8, struct.pack('!H', code)))
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+def _frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return head + payload
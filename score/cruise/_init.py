@@ -24,38 +24,506 @@
 # the discretion of STRG.AT GmbH also the competent court, in whose district the
 # Licensee has his registered seat, an establishment or assets.
 
-from score.init import ConfiguredModule, extract_conf, parse_host_port
-from .service import SocketConnector
+from score.init import (
+    ConfiguredModule, ConfigurationError, extract_conf, parse_host_port,
+    parse_time_interval)
+from .service import SocketConnector, UnixSocketConnector, all_in_state
+from .reconnect import ReconnectScheduler
+from .history import StatusHistory
+from .metrics import Metrics, ConnectorMetrics, connector_collector
 import asyncio
+import fnmatch
+import functools
+import math
+import re
 from collections import OrderedDict
 
 
-defaults = OrderedDict()
+defaults = OrderedDict([
+    ('timeout', '5s'),
+    ('concurrency', 50),
+    ('max_message_size', 1048576),
+    ('agent.socket', None),
+    ('reconnect.initial_delay', '200ms'),
+    ('reconnect.max_delay', '30s'),
+    ('reconnect.factor', 2),
+    ('reconnect.jitter', 0.5),
+    ('reconnect.concurrency', 20),
+    ('reconnect.connect_timeout', '10s'),
+    ('status_ttl', None),
+    ('history.size', 1000),
+    ('metrics.listen', None),
+    ('gateway.listen', None),
+    ('engine', 'auto'),
+    ('keepalive', None),
+    ('heartbeat.interval', None),
+    ('heartbeat.command', None),
+    ('heartbeat.max_silence', None),
+])
 
 
 def init(confdict):
     """
     Initializes this module acoording to the :ref:`SCORE module initialization
     guidelines <module_initialization>` with the following configuration keys:
+
+    :confkey:`server.*.monitor`
+        The ``host:port`` of a ``score.serve`` monitor. Every server gets its
+        own prefix, i.e. ``server.web1.monitor``, ``server.web2.monitor``, etc.
+        Monitors on the same host can also be reached through a unix domain
+        socket by passing its path as ``unix:/path/to/socket``.
+
+    :confkey:`timeout` :confdefault:`5s`
+        The time to wait for a single server to respond when querying multiple
+        servers at once. Servers that fail to respond in time will be reported
+        with the status ``timeout``.
+
+    :confkey:`concurrency` :confdefault:`50`
+        Maximum number of servers to query at the same time.
+
+    :confkey:`max_message_size` :confdefault:`1048576`
+        Maximum size of a single message from a monitor in bytes. Connections
+        to monitors sending larger messages will be closed. A value of ``0``
+        disables this limit.
+
+    :confkey:`agent.socket` :confdefault:`None`
+        Path to the unix socket of the :mod:`agent <score.cruise.agent>`. The
+        command line interface will control all servers through the agent
+        listening on this socket, if it is running.
+
+    :confkey:`reconnect.initial_delay` :confdefault:`200ms`
+        Time to wait before reconnecting to a monitor after its connection
+        was lost. The delay is multiplied by :confkey:`reconnect.factor`
+        :confdefault:`2` after every failed attempt, up to a maximum of
+        :confkey:`reconnect.max_delay` :confdefault:`30s`.
+
+    :confkey:`reconnect.jitter` :confdefault:`0.5`
+        The maximum fraction, by which each reconnection delay will be
+        shortened randomly.
+
+    :confkey:`reconnect.concurrency` :confdefault:`20`
+        Maximum number of reconnection attempts in progress at the same time.
+
+    :confkey:`reconnect.connect_timeout` :confdefault:`10s`
+        Time after which a connection attempt to a monitor is abandoned and
+        counted as failed. A value of ``0`` lets the operating system decide,
+        which may take minutes for hosts that do not respond at all.
+
+    :confkey:`status_ttl` :confdefault:`None`
+        The maximum age of a cached server status. Requesting the status of a
+        server with an older status will cause the connection to its monitor
+        to be re-established, to receive a fresh status. The cached status
+        will never expire, if this value is omitted.
+
+    :confkey:`history.size` :confdefault:`1000`
+        The number of state transitions the :mod:`agent <score.cruise.agent>`
+        remembers per server. See :class:`score.cruise.history.StatusHistory`
+        for details. A value of ``0`` disables the history. Other commands
+        never record a history, since they could not be queried for it.
+
+    :confkey:`metrics.listen` :confdefault:`None`
+        A ``host:port`` to export internal metrics on. Long-running commands,
+        like the :mod:`agent <score.cruise.agent>`, will serve the metrics in
+        the text format of Prometheus at ``/metrics``. No metrics will be
+        collected, if this value is omitted.
+
+    :confkey:`gateway.listen` :confdefault:`None`
+        The ``host:port`` the :mod:`gateway <score.cruise.gateway>` serves
+        the aggregated status of all servers on.
+
+    :confkey:`engine` :confdefault:`auto`
+        The event loop implementation to use: ``asyncio`` for the loop of the
+        standard library, or ``uvloop`` for the considerably faster
+        :mod:`uvloop`. The default ``auto`` uses uvloop if it is installed and
+        falls back to the standard loop otherwise.
+
+    :confkey:`keepalive` :confdefault:`None`
+        Enables TCP keepalive on monitor connections, with the first probe
+        being sent after this amount of time without traffic.
+
+    :confkey:`heartbeat.interval` :confdefault:`None`
+        How often to check whether a monitor connection is still alive.
+        Defaults to half of :confkey:`heartbeat.max_silence`, if that is
+        given.
+
+    :confkey:`heartbeat.command` :confdefault:`None`
+        A command to send to the monitor at every heartbeat, which the monitor
+        answers with its status. The response times are used to compute the
+        latency of the monitor.
+
+    :confkey:`heartbeat.max_silence` :confdefault:`None`
+        Connections to monitors that did not send anything for this long are
+        closed and re-established. Defaults to three heartbeat intervals, if
+        a :confkey:`heartbeat.command` is configured.
     """
     conf = defaults.copy()
     conf.update(confdict)
     servers = []
-    loop = asyncio.new_event_loop()
-    server_names = [c.split('.')[0] for c in extract_conf(conf, 'server.')]
+    max_message_size = int(conf['max_message_size'])
+    status_ttl = _parse_optional_interval(conf['status_ttl'])
+    loop, engine = new_event_loop(conf['engine'])
+    scheduler = ReconnectScheduler(
+        loop,
+        initial_delay=parse_time_interval(conf['reconnect.initial_delay']),
+        max_delay=parse_time_interval(conf['reconnect.max_delay']),
+        factor=float(conf['reconnect.factor']),
+        jitter=float(conf['reconnect.jitter']),
+        concurrency=int(conf['reconnect.concurrency']))
+    connection = {
+        'keepalive': _parse_optional_interval(conf['keepalive']),
+        'heartbeat_interval': _parse_optional_interval(
+            conf['heartbeat.interval']),
+        'heartbeat_command': conf['heartbeat.command'] or None,
+        'max_silence': _parse_optional_interval(
+            conf['heartbeat.max_silence']),
+        'connect_timeout': _parse_optional_interval(
+            conf['reconnect.connect_timeout']) or None,
+    }
+    server_names = OrderedDict.fromkeys(
+        c.split('.')[0] for c in extract_conf(conf, 'server.'))
     for name in server_names:
         server_conf = extract_conf(conf, 'server.%s.' % name)
         name = server_conf.get('name', name)
-        host, port = parse_host_port(server_conf['monitor'])
-        servers.append(
-            SocketConnector(name, loop, host, port))
-    return ConfiguredCruiseModule(loop, servers)
+        kwargs = dict(max_message_size=max_message_size,
+                      scheduler=scheduler, status_ttl=status_ttl,
+                      **connection)
+        monitor = server_conf['monitor']
+        if monitor.startswith('unix:'):
+            servers.append(UnixSocketConnector(
+                name, loop, monitor[len('unix:'):], **kwargs))
+        else:
+            host, port = parse_host_port(monitor)
+            servers.append(SocketConnector(name, loop, host, port, **kwargs))
+    metrics = None
+    metrics_listen = None
+    if conf['metrics.listen']:
+        metrics_listen = parse_host_port(conf['metrics.listen'])
+        metrics = Metrics()
+        metrics.gauge('cruise_engine_info',
+                      'The event loop implementation in use',
+                      ('engine',)).labels(engine).set(1)
+        metrics.collectors.append(connector_collector(metrics, servers))
+        for server in servers:
+            server.metrics = ConnectorMetrics(metrics, server.name)
+    gateway_listen = None
+    if conf['gateway.listen']:
+        gateway_listen = parse_host_port(conf['gateway.listen'])
+    timeout = parse_time_interval(conf['timeout'])
+    concurrency = int(conf['concurrency'])
+    return ConfiguredCruiseModule(loop, servers, timeout, concurrency,
+                                  agent_socket=conf['agent.socket'],
+                                  metrics=metrics,
+                                  metrics_listen=metrics_listen,
+                                  gateway_listen=gateway_listen,
+                                  history_size=int(conf['history.size']),
+                                  engine=engine)
+
+
+def new_event_loop(engine='auto'):
+    """
+    Creates a new event loop of given *engine*, as described in the
+    documentation of the :confkey:`engine` configuration key. Returns a
+    2-tuple containing the loop and the name of the engine actually used.
+    """
+    if engine not in ('auto', 'asyncio', 'uvloop'):
+        import score.cruise
+        raise ConfigurationError(
+            score.cruise, 'Invalid engine `%s`' % (engine,))
+    if engine != 'asyncio':
+        try:
+            import uvloop
+        except ImportError:
+            if engine == 'uvloop':
+                import score.cruise
+                raise ConfigurationError(
+                    score.cruise, 'Engine `uvloop` is not installed')
+        else:
+            return uvloop.new_event_loop(), 'uvloop'
+    return asyncio.new_event_loop(), 'asyncio'
 
 
 class ConfiguredCruiseModule(ConfiguredModule):
 
-    def __init__(self, loop, servers):
+    def __init__(self, loop, servers, timeout=5, concurrency=50, *,
+                 agent_socket=None, metrics=None, metrics_listen=None,
+                 gateway_listen=None, history_size=0, engine='asyncio'):
         import score.cruise
         super().__init__(score.cruise)
         self.loop = loop
         self.servers = servers
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.agent_socket = agent_socket
+        self.metrics = metrics
+        self.metrics_listen = metrics_listen
+        self.gateway_listen = gateway_listen
+        self.history_size = history_size
+        self.engine = engine
+
+    def run(self, coroutine):
+        """
+        Runs given *coroutine* on this module's event loop and returns its
+        result, much like :func:`asyncio.run`. All tasks that are still pending
+        once the *coroutine* finished, like connection attempts to monitors
+        that did not respond in time, are cancelled afterwards. The loop
+        itself is kept open, since all connectors are bound to it.
+        """
+        asyncio.set_event_loop(self.loop)
+        try:
+            return self.loop.run_until_complete(coroutine)
+        finally:
+            tasks = [task for task in asyncio.all_tasks(self.loop)
+                     if not task.done()]
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self.loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True))
+
+    def record_history(self):
+        """
+        Starts recording the :class:`StatusHistory
+        <score.cruise.history.StatusHistory>` of every server, unless the
+        configured ``history.size`` is ``0``. Recording requires computing a
+        delta on every status change, which only pays off in long-running
+        processes that can be queried for the history, like the agent.
+        """
+        if not self.history_size:
+            return
+        for server in self.servers:
+            if server.history is None:
+                server.history = StatusHistory(self.history_size)
+
+    async def serve_metrics(self):
+        """
+        Starts serving the metrics on the configured ``metrics.listen``
+        address, if metrics are enabled. Returns the :class:`asyncio.Server`,
+        or `None`.
+        """
+        if self.metrics is None:
+            return None
+        return (await self.metrics.serve(*self.metrics_listen))
+
+    async def get_statuses(self, servers=None, *, timeout=None,
+                           concurrency=None, max_age=None, callback=None):
+        """
+        Queries the status of all given *servers* concurrently and returns an
+        OrderedDict mapping each server to its status. The order of the
+        returned dict is the order of the *servers* parameter, which defaults
+        to all configured servers.
+
+        Each server gets *timeout* seconds to respond, the status of servers
+        that fail to do so will be the string ``timeout``. At most
+        *concurrency* servers will be queried at the same time. The
+        *max_age* is passed to each server's :meth:`get_status`.
+
+        The optional *callback* will be invoked with each server and its status
+        as soon as the status is known.
+        """
+        if servers is None:
+            servers = self.servers
+        if timeout is None:
+            timeout = self.timeout
+        if concurrency is None:
+            concurrency = self.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def query(server):
+            async with semaphore:
+                try:
+                    status = await asyncio.wait_for(
+                        server.get_status(max_age), timeout)
+                except asyncio.TimeoutError:
+                    status = 'timeout'
+            if callback:
+                callback(server, status)
+            return status
+        statuses = await asyncio.gather(
+            *(query(server) for server in servers))
+        return OrderedDict(zip(servers, statuses))
+
+    def select_servers(self, patterns, *, regex=False):
+        """
+        Returns all servers with a name matching any of the given *patterns*,
+        retaining the configured order of the servers. The patterns are
+        interpreted as shell-style wildcards (see :mod:`fnmatch`), or as
+        regular expressions, if *regex* is `True`.
+        """
+        if regex:
+            matchers = [re.compile(pattern).search for pattern in patterns]
+        else:
+            matchers = [re.compile(fnmatch.translate(pattern)).match
+                        for pattern in patterns]
+        return [server for server in self.servers
+                if any(match(server.name) for match in matchers)]
+
+    async def run_command(self, command, servers=None, *, timeout=None,
+                           concurrency=None, wait=None, callback=None):
+        """
+        Sends a *command* (i.e. ``start``, ``pause``, ``stop`` or ``restart``)
+        to all given *servers* concurrently. If *wait* is given, each server
+        additionally gets *wait* seconds to confirm the command (see
+        :class:`score.cruise.service.PendingCommand`).
+
+        Returns an OrderedDict mapping each server to the exception that
+        prevented the command from succeeding. On success, the value is the
+        number of seconds it took the server to confirm the command, or
+        `None` if the confirmation was not awaited.
+
+        The parameters *timeout*, *concurrency* and *callback* behave just like
+        the ones of :meth:`get_statuses`.
+        """
+        if command not in ('start', 'pause', 'stop', 'restart'):
+            raise ValueError('Invalid command `%s`' % (command,))
+        if servers is None:
+            servers = self.servers
+        if timeout is None:
+            timeout = self.timeout
+        if concurrency is None:
+            concurrency = self.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(server):
+            async with semaphore:
+                try:
+                    confirmation = await asyncio.wait_for(
+                        getattr(server, command)(), timeout)
+                    result = None
+                    if wait is not None:
+                        result = await asyncio.wait_for(
+                            confirmation, wait)
+                except (asyncio.TimeoutError, OSError) as e:
+                    result = e
+            if callback:
+                callback(server, result)
+            return result
+        results = await asyncio.gather(
+            *(send(server) for server in servers))
+        return OrderedDict(zip(servers, results))
+
+    async def wait_for_state(self, state, servers=None, *, timeout=None,
+                             callback=None):
+        """
+        Waits until all services of each given server are in given *state*,
+        using a single connection per server (see
+        :meth:`score.cruise.service.ServeConnector.wait_for`). The *servers*
+        default to all configured servers.
+
+        Returns an OrderedDict mapping each server to the number of seconds
+        it took to reach the *state*, or to the :class:`asyncio.TimeoutError`
+        if it did not do so within *timeout* seconds. The optional *callback*
+        is invoked with each server and its result as soon as it is known.
+        """
+        if servers is None:
+            servers = self.servers
+        predicate = functools.partial(all_in_state, state=state)
+
+        async def wait(server):
+            start = self.loop.time()
+            try:
+                await server.wait_for(predicate, timeout)
+                result = self.loop.time() - start
+            except asyncio.TimeoutError as e:
+                result = e
+            if callback:
+                callback(server, result)
+            return result
+        results = await asyncio.gather(*(wait(server) for server in servers))
+        return OrderedDict(zip(servers, results))
+
+    async def query_history(self, query, servers=None, **kwargs):
+        """
+        Runs a history *query* on all given *servers* concurrently and returns
+        an OrderedDict mapping each server to its result. Valid queries are
+        the names of the query methods of
+        :class:`score.cruise.history.StatusHistory`, i.e. ``transitions``,
+        ``flaps``, ``time_in_state`` and ``uptime``, and *kwargs* are passed
+        to that method.
+        """
+        if servers is None:
+            servers = self.servers
+        results = await asyncio.gather(
+            *(server.query_history(query, **kwargs) for server in servers))
+        return OrderedDict(zip(servers, results))
+
+    async def rolling_restart(self, servers=None, *, batch_size=1, deadline=60,
+                              stop_failed=False, callback=None):
+        """
+        Restarts given *servers* (defaulting to all configured servers) in
+        batches of *batch_size* servers. The *batch_size* may also be a string
+        containing a percentage of the servers, like ``'25%'``.
+
+        Every server in a batch is restarted concurrently, after which all of
+        them must report that all their services are running again within
+        *deadline* seconds. The next batch is only processed once the current
+        batch has recovered. If a batch fails to recover in time, the
+        remaining batches will not be restarted at all. The servers of the
+        failing batch will additionally be stopped, if *stop_failed* is
+        `True`.
+
+        The return value is an OrderedDict mapping each server to one of the
+        strings ``ok``, ``failed`` or ``skipped``. The optional *callback* is
+        invoked with each server and its result as soon as it is known.
+        """
+        if servers is None:
+            servers = self.servers
+        batch_size = _parse_batch_size(batch_size, len(servers))
+        results = OrderedDict((server, 'skipped') for server in servers)
+        for offset in range(0, len(servers), batch_size):
+            batch = servers[offset:offset + batch_size]
+            recovered = await asyncio.gather(
+                *(self._restart_and_wait(server, deadline)
+                  for server in batch))
+            for server, success in zip(batch, recovered):
+                results[server] = 'ok' if success else 'failed'
+                if callback:
+                    callback(server, results[server])
+            if all(recovered):
+                continue
+            if stop_failed:
+                failed = [server for server, success in zip(batch, recovered)
+                          if not success]
+                await self.run_command('stop', failed)
+            if callback:
+                for server in servers[offset + batch_size:]:
+                    callback(server, 'skipped')
+            break
+        return results
+
+    async def _restart_and_wait(self, server, deadline):
+        """
+        Restarts a single *server* and returns a boolean indicating whether it
+        confirmed the restart within *deadline* seconds.
+        """
+        try:
+            await asyncio.wait_for(
+                self._send_and_confirm(server, 'restart'), deadline)
+            return True
+        except (asyncio.TimeoutError, OSError):
+            return False
+
+    async def _send_and_confirm(self, server, command):
+        confirmation = await getattr(server, command)()
+        return (await confirmation)
+
+
+def _parse_optional_interval(value):
+    if not value:
+        return None
+    return parse_time_interval(value)
+
+
+def _parse_batch_size(value, total):
+    """
+    Converts a *value* describing a batch size to an `int`. The *value* may
+    either be a number of servers, or a percentage of the *total* number of
+    servers, like ``'25%'``.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith('%'):
+            value = math.ceil(total * float(value[:-1]) / 100)
+    value = int(value)
+    if value < 1:
+        raise ValueError('Invalid batch size')
+    return value
@@ -0,0 +1,382 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+A long-running process holding connections to all configured monitors, which
+can be queried by short-lived processes through a unix socket.
+
+The agent and its clients exchange newline-delimited JSON messages. Every
+request contains a ``command`` and an ``id``, which is echoed in the
+response, along with either a ``result`` or an ``error``. Clients that have
+subscribed to a server additionally receive ``event`` messages whenever the
+status of that server changes. Statuses are always accompanied by the
+``latency`` of the server's monitor.
+"""
+
+import asyncio
+import functools
+import json
+import os
+from collections import OrderedDict
+
+from .service import ServeConnector, ServeProtocol, decode_json
+
+
+class AgentError(Exception):
+    """
+    Raised by the client, if the agent reported an error that does not
+    translate to a built-in exception.
+    """
+
+
+_errors = {
+    'ConnectionError': ConnectionError,
+    'ConnectionRefusedError': ConnectionRefusedError,
+    'ConnectionResetError': ConnectionResetError,
+    'TimeoutError': asyncio.TimeoutError,
+    'KeyError': KeyError,
+    'ValueError': ValueError,
+}
+
+
+class Agent:
+    """
+    Serves the servers of given :class:`ConfiguredCruiseModule` *cruise* on
+    the unix socket at *path*.
+    """
+
+    def __init__(self, cruise, path):
+        self.cruise = cruise
+        self.loop = cruise.loop
+        self.path = path
+        self.servers = OrderedDict(
+            (server.name, server) for server in cruise.servers)
+        self.sessions = set()
+        self._callbacks = OrderedDict()
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            if (await self._is_alive()):
+                raise RuntimeError(
+                    'Another agent is already listening on %s' % self.path)
+            os.unlink(self.path)
+        self.cruise.record_history()
+        for server in self.cruise.servers:
+            callback = functools.partial(self._status_change, server)
+            self._callbacks[server] = callback
+            server.add_status_change_callback(callback)
+        self._server = await self.loop.create_unix_server(
+            self._create_protocol, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        for server, callback in self._callbacks.items():
+            server.remove_status_change_callback(callback)
+        self._callbacks.clear()
+
+    async def _is_alive(self):
+        try:
+            transport, _ = await self.loop.create_unix_connection(
+                asyncio.Protocol, self.path)
+        except OSError:
+            return False
+        transport.close()
+        return True
+
+    def _create_protocol(self):
+        session = AgentSession(self)
+        session.protocol = ServeProtocol(session)
+        return session.protocol
+
+    def _status_change(self, server, status):
+        for session in self.sessions:
+            if server in session.subscriptions:
+                session.send({
+                    'event': 'status',
+                    'server': server.name,
+                    'status': status,
+                    'latency': server.latency,
+                })
+
+    async def handle(self, session, request):
+        command = request.get('command')
+        if command == 'servers':
+            return list(self.servers)
+        if command == 'confirm':
+            return (await session.confirm(request['token']))
+        if command == 'cancel':
+            session.cancel_command(request['token'])
+            return None
+        try:
+            server = self.servers[request.get('server')]
+        except KeyError:
+            raise KeyError('Unknown server `%s`' % (request.get('server'),))
+        if command == 'status':
+            status = await server.get_status(request.get('max_age'))
+            return {'status': status, 'latency': server.latency}
+        elif command in ('start', 'pause', 'stop', 'restart'):
+            future = await getattr(server, command)()
+            return session.track_command(future)
+        elif command == 'history':
+            return (await server.query_history(
+                request['query'], **request.get('arguments', {})))
+        elif command == 'subscribe':
+            session.subscriptions.add(server)
+            return {'status': server.status, 'latency': server.latency}
+        elif command == 'unsubscribe':
+            session.subscriptions.discard(server)
+            return None
+        raise ValueError('Unknown command `%s`' % (command,))
+
+
+class AgentSession:
+    """
+    The agent's end of a connection to a client.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.loop = agent.loop
+        self.name = 'agent client'
+        self.protocol = None
+        self.subscriptions = set()
+        self.commands = {}
+        self._next_token = 0
+        agent.sessions.add(self)
+
+    def track_command(self, future):
+        """
+        Stores the *future* of a command until the client requests its
+        confirmation and returns the token to request it with.
+        """
+        self._next_token += 1
+        self.commands[self._next_token] = future
+        return self._next_token
+
+    async def confirm(self, token):
+        """
+        Waits for the confirmation of the command identified by *token*.
+        """
+        future = self.commands[token]
+        try:
+            return (await future)
+        finally:
+            self.commands.pop(token, None)
+
+    def cancel_command(self, token):
+        """
+        Stops waiting for the confirmation of the command identified by
+        *token*, since the client is no longer interested in it.
+        """
+        future = self.commands.pop(token, None)
+        if future is not None:
+            future.cancel()
+
+    def send(self, message):
+        transport = self.protocol.transport
+        if transport is None or transport.is_closing():
+            return
+        transport.write(json.dumps(message).encode('UTF-8') + b'\n')
+
+    def _message_received(self, message):
+        request = decode_json(message)
+        self.loop.create_task(self._handle(request))
+
+    async def _handle(self, request):
+        response = {'id': request.get('id')}
+        try:
+            response['result'] = await self.agent.handle(self, request)
+        except Exception as e:
+            response['error'] = type(e).__name__
+            response['message'] = str(e)
+        self.send(response)
+
+    def _connection_lost(self):
+        self.agent.sessions.discard(self)
+        for future in self.commands.values():
+            future.cancel()
+        self.commands.clear()
+
+
+class AgentClient:
+    """
+    A client connection to an :class:`Agent` listening on *path*.
+    """
+
+    def __init__(self, loop, path):
+        self.loop = loop
+        self.path = path
+        self.name = 'agent'
+        self.connectors = {}
+        self.protocol = None
+        self._requests = {}
+        self._next_id = 0
+
+    async def connect(self):
+        _, self.protocol = await self.loop.create_unix_connection(
+            lambda: ServeProtocol(self), self.path)
+
+    def close(self):
+        if self.protocol is not None:
+            self.protocol.transport.close()
+
+    async def request(self, command, **kwargs):
+        if self.protocol is None or self.protocol.transport.is_closing():
+            raise ConnectionError('Not connected to cruise agent')
+        self._next_id += 1
+        kwargs['id'] = self._next_id
+        kwargs['command'] = command
+        future = self.loop.create_future()
+        self._requests[self._next_id] = future
+        self.protocol.transport.write(
+            json.dumps(kwargs).encode('UTF-8') + b'\n')
+        return (await future)
+
+    def _message_received(self, message):
+        message = decode_json(message)
+        if 'event' in message:
+            connector = self.connectors.get(message['server'])
+            if connector is not None:
+                connector.latency = message.get('latency')
+                connector._status_change(message['status'])
+            return
+        future = self._requests.pop(message['id'], None)
+        if future is None or future.done():
+            return
+        if 'error' in message:
+            error = _errors.get(message['error'], AgentError)
+            future.set_exception(error(message['message']))
+        else:
+            future.set_result(message['result'])
+
+    def _connection_lost(self):
+        self.protocol = None
+        for future in self._requests.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError('Connection to cruise agent lost'))
+        self._requests.clear()
+
+
+class AgentConnector(ServeConnector):
+    """
+    Controls a server through an :class:`AgentClient`.
+    """
+
+    def __init__(self, name, loop, client):
+        super().__init__(name, loop)
+        self.client = client
+        client.connectors[name] = self
+
+    async def start(self):
+        return (await self._send_command('start'))
+
+    async def pause(self):
+        return (await self._send_command('pause'))
+
+    async def stop(self):
+        return (await self._send_command('stop'))
+
+    async def restart(self):
+        return (await self._send_command('restart'))
+
+    async def _send_command(self, command):
+        token = await self.client.request(command, server=self.name)
+        return self.loop.create_task(self._confirm(token))
+
+    async def _confirm(self, token):
+        try:
+            return (await self.client.request('confirm', token=token))
+        except asyncio.CancelledError:
+            # the agent would otherwise keep the command pending for as long
+            # as this client stays connected
+            if self.client.protocol is not None:
+                self.loop.create_task(
+                    self.client.request('cancel', token=token))
+            raise
+
+    async def get_status(self, max_age=None):
+        if max_age is None and self.status is not None and self.subscribed:
+            return self.status
+        result = await self.client.request(
+            'status', server=self.name, max_age=max_age)
+        self.latency = result['latency']
+        return result['status']
+
+    async def query_history(self, query, **kwargs):
+        return (await self.client.request(
+            'history', server=self.name, query=query, arguments=kwargs))
+
+    def _subscriber_added(self):
+        if len(self.status_hub) + len(self.delta_hub) == 1:
+            self.loop.create_task(self._subscribe())
+
+    def _subscriber_removed(self):
+        if not self.subscribed:
+            self.status = None
+            self.loop.create_task(
+                self.client.request('unsubscribe', server=self.name))
+
+    async def _subscribe(self):
+        result = await self.client.request('subscribe', server=self.name)
+        self.latency = result['latency']
+        if result['status'] is not None:
+            self._status_change(result['status'])
+
+
+def init_client(confdict):
+    """
+    Creates a :class:`ConfiguredCruiseModule` controlling all servers through
+    the agent configured in given *confdict*. Returns `None` if no agent is
+    configured, or if it is not running.
+    """
+    from ._init import defaults, new_event_loop, ConfiguredCruiseModule
+    from score.init import parse_time_interval
+    conf = defaults.copy()
+    conf.update(confdict)
+    if not conf.get('agent.socket'):
+        return None
+    loop, engine = new_event_loop(conf['engine'])
+    client = AgentClient(loop, conf['agent.socket'])
+    try:
+        loop.run_until_complete(client.connect())
+        names = loop.run_until_complete(client.request('servers'))
+    except OSError:
+        loop.close()
+        return None
+    servers = [AgentConnector(name, loop, client) for name in names]
+    return ConfiguredCruiseModule(
+        loop, servers, parse_time_interval(conf['timeout']),
+        int(conf['concurrency']), agent_socket=conf['agent.socket'],
+        engine=engine)
@@ -27,197 +27,670 @@
 
 import curses
 import asyncio
+import bisect
+import functools
+import logging
+import sys
+from collections import OrderedDict
+
+
+class Renderer:
+    """
+    Coalesces screen updates into frames. Widgets :meth:`invalidate`
+    themselves whenever their content changes, and all invalidated widgets
+    will be asked to render themselves into their (virtual) windows during the
+    next frame, which is then written to the terminal with a single
+    :func:`curses.doupdate`. At most *fps* frames will be rendered per
+    second.
+    """
+
+    def __init__(self, loop, fps=20):
+        self.loop = loop
+        self.interval = 1 / fps
+        self.dirty = OrderedDict()
+        self._handle = None
+        self._last_frame = 0
+
+    def invalidate(self, widget):
+        self.dirty[widget] = True
+        if self._handle is not None:
+            return
+        delay = self._last_frame + self.interval - self.loop.time()
+        self._handle = self.loop.call_later(max(0, delay), self.render)
+
+    def render(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._last_frame = self.loop.time()
+        dirty, self.dirty = self.dirty, OrderedDict()
+        for widget in dirty:
+            widget.render()
+        curses.doupdate()
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class NameFilter:
+    """
+    Incremental, case-insensitive substring search on a list of *names*.
+    Every query is answered by narrowing down the matches of the previous,
+    shorter query, so typing a query never scans the whole list again.
+    The matches are lists of indexes into *names*, in ascending order.
+    """
+
+    def __init__(self, names):
+        self.names = [name.lower() for name in names]
+        self.stack = [('', list(range(len(self.names))))]
+
+    @property
+    def query(self):
+        return self.stack[-1][0]
+
+    @property
+    def matches(self):
+        return self.stack[-1][1]
+
+    def push(self, char):
+        query = self.query + char.lower()
+        matches = [i for i in self.matches if query in self.names[i]]
+        self.stack.append((query, matches))
+
+    def pop(self):
+        if len(self.stack) > 1:
+            self.stack.pop()
+
+    def reset(self):
+        del self.stack[1:]
 
 
 class ServersMenu:
+    """
+    The list of servers on the left. Only the servers inside the viewport
+    are rendered, and the list can be filtered by typing ``/`` followed by a
+    part of a server name.
+    """
 
     def __init__(self, main):
         self.main = main
         self.index = 0
+        self.top = 0
         self.window = None
         self.servers = self.main.cruise.servers
         self.max_name_length = max(len(srv.name) for srv in self.servers)
+        self.filter = NameFilter(server.name for server in self.servers)
+        self.searching = False
+        self.dirty_buttons = set()
+        self.needs_erase = True
+
+    @property
+    def matches(self):
+        return self.filter.matches
+
+    @property
+    def page(self):
+        """
+        The number of buttons fitting into the window.
+        """
+        return max(1, self.height - 2)
+
+    @property
+    def server(self):
+        """
+        The currently selected server, or `None` if no server matches the
+        current filter.
+        """
+        if not self.matches:
+            return None
+        return self.servers[self.matches[self.index]]
 
-    @asyncio.coroutine
-    def redraw(self):
+    async def redraw(self):
         self.padding = 5
         new_width = self.max_name_length + self.padding * 2 + 1
         new_height, _ = self.main.window.getmaxyx()
         if self.window is None:
             self.window = self.main.window.derwin(new_height, new_width, 0, 0)
         elif self.width != new_width or self.height != new_height:
-            self.window.erase()
             self.window.resize(new_height, new_width)
         self.width = new_width
         self.height = new_height
-        self.window.vline(0, self.width - 1, '|', new_height)
-        for i, server in enumerate(self.servers):
-            self.draw_button(i)
+        self._scroll_to_selection()
+        self.needs_erase = True
+        self.main.renderer.invalidate(self)
+
+    def draw_button(self, pos):
+        self.dirty_buttons.add(pos)
+        self.main.renderer.invalidate(self)
+
+    def render(self):
+        if self.needs_erase:
+            self.window.erase()
+            self.window.vline(0, self.width - 1, '|', self.height)
+            self.dirty_buttons = set(range(self.top, self.top + self.page))
+            self.render_prompt()
+            self.needs_erase = False
+        for pos in self.dirty_buttons:
+            if self.top <= pos < self.top + self.page:
+                self.render_button(pos)
+        self.dirty_buttons.clear()
+        self.window.noutrefresh()
 
-    def draw_button(self, idx):
+    def render_button(self, pos):
+        row = pos - self.top + 1
+        if pos >= len(self.matches):
+            self.window.move(row, 0)
+            self.window.addstr(' ' * (self.width - 1))
+            return
         tpl = '{:%d}' % self.max_name_length
         padding = ' ' * self.padding
-        server = self.servers[idx]
+        server = self.servers[self.matches[pos]]
         attr = 0
-        if idx == self.index:
+        if pos == self.index:
             attr = curses.A_REVERSE
         text = padding + tpl.format(server.name) + padding
-        self.window.addstr(idx + 1, 0, text, attr)
+        self.window.addstr(row, 0, text, attr)
 
-    @asyncio.coroutine
-    def handle_keypress(self, char):
-        needs_refresh = False
-        try:
+    def render_prompt(self):
+        if not self.searching and not self.filter.query:
+            return
+        text = ('/' + self.filter.query)[-(self.width - 2):]
+        self.window.addstr(self.height - 1, 0, text)
+
+    async def handle_keypresses(self, chars):
+        """
+        Handles a batch of keys that were pressed since the last invocation.
+        Consecutive movements of the selection are combined into a single
+        selection change. Returns `True` if the user requested to quit.
+        """
+        movement = 0
+        for char in chars:
+            if self.searching:
+                await self.handle_search_keypress(char)
+                continue
             if char == curses.KEY_DOWN:
-                needs_refresh = yield from self.select_next_server()
+                movement += 1
             elif char == curses.KEY_UP:
-                needs_refresh = yield from self.select_previous_server()
+                movement -= 1
+            elif char == curses.KEY_NPAGE:
+                movement += self.page
+            elif char == curses.KEY_PPAGE:
+                movement -= self.page
+            else:
+                if movement:
+                    await self.move_selection(movement)
+                    movement = 0
+                if char in (ord('q'), ord('Q')):
+                    return True
+                await self.handle_keypress(char)
+        if movement:
+            await self.move_selection(movement)
+        return False
+
+    async def handle_keypress(self, char):
+        try:
+            # movements are handled by handle_keypresses()
+            if char in (curses.KEY_HOME, ord('g')):
+                await self.select(0)
+            elif char in (curses.KEY_END, ord('G')):
+                await self.select(len(self.matches) - 1)
+            elif char == ord('/'):
+                self.searching = True
+                self.needs_erase = True
+                self.main.renderer.invalidate(self)
+            elif char == 27:  # escape
+                await self.set_filter(self.filter.reset)
+            elif char == ord('o'):
+                self.main.toggle_overview()
+            elif self.server is None:
+                pass
             elif char == ord('r'):
-                yield from self.servers[self.index].restart()
+                await self.send_command('restart')
             elif char == ord('s'):
-                yield from self.servers[self.index].start()
+                await self.send_command('start')
             elif char == ord('p'):
-                yield from self.servers[self.index].pause()
+                await self.send_command('pause')
             elif char == ord('k'):
-                yield from self.servers[self.index].stop()
+                await self.send_command('stop')
         except ConnectionError:
             # no need to handle connection errors here, the status of the server
             # connectino will be updated and propagated back to us through our
             # state_change_callback
             pass
-        if needs_refresh:
-            self.window.refresh()
 
-    @asyncio.coroutine
-    def select_next_server(self):
-        if self.index >= len(self.servers) - 1:
-            return False
-        self.index += 1
-        self.draw_button(self.index - 1)
-        self.draw_button(self.index)
-        yield from self.main.details.set_server(self.servers[self.index])
-        return True
+    async def handle_search_keypress(self, char):
+        if char in (curses.KEY_ENTER, 10, 13):
+            self.searching = False
+            self.needs_erase = True
+            self.main.renderer.invalidate(self)
+        elif char == 27:  # escape
+            self.searching = False
+            await self.set_filter(self.filter.reset)
+        elif char in (curses.KEY_BACKSPACE, 127, 8):
+            if not self.filter.query:
+                self.searching = False
+            await self.set_filter(self.filter.pop)
+        elif 32 <= char < 127:
+            await self.set_filter(self.filter.push, chr(char))
+
+    async def set_filter(self, operation, *args):
+        """
+        Modifies the filter by calling given *operation* and keeps the
+        selected server, if it still matches the new filter.
+        """
+        selected = self.matches[self.index] if self.matches else None
+        operation(*args)
+        self.index = 0
+        if selected is not None:
+            pos = bisect.bisect_left(self.matches, selected)
+            if pos < len(self.matches) and self.matches[pos] == selected:
+                self.index = pos
+        self.top = 0
+        self._scroll_to_selection()
+        self.needs_erase = True
+        self.main.renderer.invalidate(self)
+        if self.server is not None and \
+                self.server is not self.main.details.server:
+            await self.main.details.set_server(self.server)
+
+    async def send_command(self, command):
+        server = self.server
+        confirmation = await getattr(server, command)()
+        self.main.details.show_message(server, '%s: pending' % (command,))
+        confirmation.add_done_callback(
+            functools.partial(self._command_done, server, command))
+
+    def _command_done(self, server, command, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            text = '%s: failed' % (command,)
+        else:
+            text = '%s: done in %.1fs' % (command, future.result())
+        self.main.details.show_message(server, text)
+
+    async def move_selection(self, offset):
+        return (await self.select(self.index + offset))
 
-    @asyncio.coroutine
-    def select_previous_server(self):
-        if self.index == 0:
+    async def select(self, pos):
+        if not self.matches:
             return False
-        self.index -= 1
-        self.draw_button(self.index + 1)
+        pos = max(0, min(len(self.matches) - 1, pos))
+        if pos == self.index:
+            return False
+        previous = self.server
+        self.draw_button(self.index)
+        self.index = pos
         self.draw_button(self.index)
-        yield from self.main.details.set_server(self.servers[self.index])
+        self._scroll_to_selection()
+        self.main.overview.mark(previous, self.server)
+        await self.main.details.set_server(self.server)
         return True
 
-    @asyncio.coroutine
-    def cleanup(self):
+    def _scroll_to_selection(self):
+        top = self.top
+        if self.index < top:
+            top = self.index
+        elif self.index >= top + self.page:
+            top = self.index - self.page + 1
+        if top != self.top:
+            self.top = top
+            self.needs_erase = True
+
+    async def cleanup(self):
         pass
 
 
 class ServerDetails:
+    """
+    Shows the services of the selected server. The content of the window is
+    kept as a list of :attr:`lines`, and only lines that differ from the
+    ones on the screen are written during rendering.
+    """
 
     def __init__(self, main):
         self.main = main
         self.window = None
         self.server = None
+        self.rows = {}
+        self.lines = []
+        self.drawn = []
+        self.messages = {}
+        self.needs_erase = True
 
-    @asyncio.coroutine
-    def redraw(self):
+    async def redraw(self):
         self.padding = 5
         new_height, width = self.main.window.getmaxyx()
         new_width = width - self.main.menu.width
         if self.window is None:
             self.window = self.main.window.derwin(
                 new_height, new_width, 0, self.main.menu.width)
-        elif self.width != new_width:
-            self.window.erase()
+        elif self.width != new_width or self.height != new_height:
             self.window.resize(new_height, new_width)
         self.width = new_width
         self.height = new_height
-        if self.server is None:
-            return
-        yield from self.draw_details()
+        self.needs_erase = True
+        self.main.renderer.invalidate(self)
 
-    @asyncio.coroutine
-    def draw_details(self, status=None):
+    async def draw_details(self, status=None):
         if status is None:
             server = self.server
-            status = yield from server.get_status()
+            status = await server.get_status()
             if server != self.server:
                 # server was deselected while get_status() was being executed.
                 return
-        self.window.clear()  # TODO: erase()?
+            if server.status is not None:
+                # changes received in the meantime were ignored
+                status = server.status
+        self.show_status(status)
+
+    def show_status(self, status):
+        self.rows = {}
+        self.lines = ['']
         if isinstance(status, str):
-            text = '<%s>' % status
-            self.window.addstr(1, self.padding, text)
+            self.lines.append('<%s>' % status)
         else:
-            for i, (service, state) in enumerate(status.items()):
-                text = '%s: %s' % (service, state)
-                self.window.addstr(1 + i, self.padding, text)
-        self.window.refresh()
+            for service, state in status.items():
+                self.rows[service] = len(self.lines)
+                self.lines.append('%s: %s' % (service, state))
+        self.main.renderer.invalidate(self)
+
+    def show_message(self, server, text):
+        self.messages[server] = text
+        if server is self.server:
+            self.main.renderer.invalidate(self)
 
-    @asyncio.coroutine
-    def set_server(self, server):
+    def render(self):
+        if self.main.pane is not self:
+            return
+        if self.needs_erase:
+            self.window.erase()
+            self.drawn = []
+            self.needs_erase = False
+        lines = self.lines[:self.height - 2]
+        lines += [''] * (self.height - 2 - len(lines))
+        lines.append(self.messages.get(self.server, ''))
+        for row, line in enumerate(lines):
+            if row < len(self.drawn) and self.drawn[row] == line:
+                continue
+            self.window.move(row, 0)
+            self.window.clrtoeol()
+            if line:
+                self.window.addnstr(row, self.padding, line,
+                                    max(0, self.width - self.padding - 1))
+        self.drawn = lines
+        self.window.noutrefresh()
+
+    async def set_server(self, server):
         if self.server:
-            self.server.remove_status_change_callback(self._status_change)
+            self.server.remove_status_delta_callback(self._status_delta)
         self.server = server
-        self.server.add_status_change_callback(self._status_change)
-        yield from self.draw_details()
+        # the rows still belong to the previous server until show_status()
+        self.rows = None
+        self.server.add_status_delta_callback(self._status_delta)
+        await self.draw_details()
+
+    def _status_delta(self, delta):
+        if self.rows is None:
+            # draw_details() will show the status including this change
+            return
+        if delta.added or delta.removed or isinstance(delta.new, str):
+            self.show_status(delta.new)
+            return
+        for service, (_, state) in delta.changed.items():
+            self.lines[self.rows[service]] = '%s: %s' % (service, state)
+        self.main.renderer.invalidate(self)
+
+    async def cleanup(self):
+        self.server.remove_status_delta_callback(self._status_delta)
 
-    @asyncio.coroutine
-    def _status_change(self, status):
-        yield from self.draw_details(status)
 
-    @asyncio.coroutine
-    def cleanup(self):
-        self.server.remove_status_change_callback(self._status_change)
+class FleetOverview:
+    """
+    Shows the health of all servers at once, as one colored cell per server
+    and a line of counters. The overview keeps a status change callback on
+    every server and updates its counters and cells incrementally.
+    """
+
+    categories = ('running', 'paused', 'stopped', 'offline', 'other')
+
+    colors = {
+        'running': curses.COLOR_GREEN,
+        'paused': curses.COLOR_YELLOW,
+        'stopped': curses.COLOR_RED,
+        'offline': curses.COLOR_MAGENTA,
+        'other': curses.COLOR_CYAN,
+    }
+
+    def __init__(self, main):
+        self.main = main
+        self.window = None
+        self.servers = main.cruise.servers
+        self.positions = dict(
+            (server, pos) for pos, server in enumerate(self.servers))
+        self.health = [None] * len(self.servers)
+        self.counts = dict((category, 0) for category in self.categories)
+        self.callbacks = []
+        self.dirty_cells = set()
+        self.needs_erase = True
+        self.attributes = {}
+
+    @staticmethod
+    def categorize(status):
+        if status is None:
+            return None
+        if isinstance(status, str):
+            return 'offline'
+        states = set(status.values())
+        for category in ('stopped', 'paused', 'running'):
+            if category in states:
+                if category != 'running' or len(states) == 1:
+                    return category
+        return 'other'
+
+    def subscribe(self):
+        if curses.has_colors():
+            for idx, category in enumerate(self.categories, start=1):
+                curses.init_pair(idx, curses.COLOR_BLACK,
+                                 self.colors[category])
+                self.attributes[category] = curses.color_pair(idx)
+        for server in self.servers:
+            callback = functools.partial(self._status_change, server)
+            self.callbacks.append((server, callback))
+            server.add_status_change_callback(callback)
+            if server.status is not None:
+                self._status_change(server, server.status)
+
+    async def redraw(self):
+        self.padding = 2
+        new_height, width = self.main.window.getmaxyx()
+        new_width = width - self.main.menu.width
+        if self.window is None:
+            self.window = self.main.window.derwin(
+                new_height, new_width, 0, self.main.menu.width)
+        elif self.width != new_width or self.height != new_height:
+            self.window.resize(new_height, new_width)
+        self.width = new_width
+        self.height = new_height
+        self.columns = max(1, (self.width - self.padding * 2) // 2)
+        self.needs_erase = True
+        self.main.renderer.invalidate(self)
+
+    def mark(self, *servers):
+        """
+        Schedules the cells of given *servers* for rendering, to update the
+        highlighting of the selected server.
+        """
+        for server in servers:
+            if server in self.positions:
+                self.dirty_cells.add(self.positions[server])
+        self.main.renderer.invalidate(self)
+
+    def _status_change(self, server, status):
+        pos = self.positions[server]
+        category = self.categorize(status)
+        if category == self.health[pos]:
+            return
+        if self.health[pos] is not None:
+            self.counts[self.health[pos]] -= 1
+        if category is not None:
+            self.counts[category] += 1
+        self.health[pos] = category
+        self.dirty_cells.add(pos)
+        self.main.renderer.invalidate(self)
+
+    def render(self):
+        if self.main.pane is not self:
+            return
+        if self.needs_erase:
+            self.window.erase()
+            self.dirty_cells = set(range(len(self.servers)))
+            self.needs_erase = False
+        counters = '  '.join('%s: %d' % (category, self.counts[category])
+                             for category in self.categories)
+        self.window.move(1, 0)
+        self.window.clrtoeol()
+        self.window.addnstr(1, self.padding, counters,
+                            max(0, self.width - self.padding - 1))
+        for pos in self.dirty_cells:
+            self.render_cell(pos)
+        self.dirty_cells.clear()
+        self.window.noutrefresh()
+
+    def render_cell(self, pos):
+        row = 3 + pos // self.columns
+        if row >= self.height:
+            return
+        column = self.padding + (pos % self.columns) * 2
+        category = self.health[pos]
+        attr = self.attributes.get(category, curses.A_REVERSE)
+        char = ' '
+        if category is None:
+            attr = 0
+            char = '?'
+        elif not self.attributes:
+            # no colors available
+            char = category[0]
+        if self.servers[pos] is self.main.menu.server:
+            attr |= curses.A_UNDERLINE | curses.A_BOLD
+            if char == ' ':
+                char = '*'
+        self.window.addstr(row, column, char, attr)
+
+    async def cleanup(self):
+        for server, callback in self.callbacks:
+            server.remove_status_change_callback(callback)
+        self.callbacks = []
+
+
+class MessageLineHandler(logging.Handler):
+    """
+    Shows log records in the message line of the server they concern, or of
+    the selected server, if a record does not concern a specific server.
+    """
+
+    def __init__(self, main):
+        super().__init__(logging.WARNING)
+        self.main = main
+
+    def emit(self, record):
+        details = self.main.details
+        server = getattr(record, 'server', None)
+        if server not in self.main.cruise.servers:
+            server = details.server
+        details.show_message(server, record.getMessage())
 
 
 class MainWindow:
 
-    def __init__(self, cruise, window):
+    def __init__(self, cruise, window, fps=20):
         self.cruise = cruise
         self.window = window
+        self.renderer = Renderer(cruise.loop, fps)
         self.menu = ServersMenu(self)
         self.details = ServerDetails(self)
+        self.overview = FleetOverview(self)
+        self.pane = self.details
+
+    def toggle_overview(self):
+        if self.pane is self.details:
+            self.pane = self.overview
+        else:
+            self.pane = self.details
+        self.pane.needs_erase = True
+        self.renderer.invalidate(self.pane)
 
     def run(self):
+        # log records would otherwise end up on stderr, right across the
+        # screen. they are shown in the message line of the details instead.
+        handler = MessageLineHandler(self)
+        loggers = [logging.getLogger(name)
+                   for name in ('score.cruise', 'asyncio')]
+        propagate = [logger.propagate for logger in loggers]
+        for logger in loggers:
+            logger.addHandler(handler)
+            logger.propagate = False
+        try:
+            # pending tasks, like connection attempts to unreachable monitors,
+            # are of no interest to us any more and will be cancelled by
+            # cruise.run()
+            self.cruise.run(self._run())
+        finally:
+            for logger, value in zip(loggers, propagate):
+                logger.removeHandler(handler)
+                logger.propagate = value
+
+    async def _run(self):
         loop = self.cruise.loop
-        loop.run_until_complete(self._run())
-        pending_tasks = [t for t in asyncio.Task.all_tasks(loop)
-                         if not t.done()]
-        while pending_tasks:
-            loop.run_until_complete(pending_tasks[0])
-            pending_tasks = [t for t in asyncio.Task.all_tasks(loop)
-                             if not t.done()]
-
-    @asyncio.coroutine
-    def _run(self):
-        yield from self.redraw()
-        yield from self.details.set_server(self.cruise.servers[0])
-        char = yield from self._getch()
-        while char not in (ord('q'), ord('Q')):
-            if char in (curses.KEY_RESIZE, curses.KEY_CLEAR):
-                yield from self.redraw()
-            else:
-                yield from self.menu.handle_keypress(char)
-            char = yield from self._getch()
-        yield from self.menu.cleanup()
-        yield from self.details.cleanup()
+        await self.cruise.serve_metrics()
+        self.keys = asyncio.Queue()
+        self.window.nodelay(True)
+        loop.add_reader(sys.stdin.fileno(), self._read_keys)
+        try:
+            await self.redraw()
+            self.overview.subscribe()
+            await self.details.set_server(self.cruise.servers[0])
+            while True:
+                chars = await self.keys.get()
+                if curses.KEY_RESIZE in chars or curses.KEY_CLEAR in chars:
+                    await self.redraw()
+                    chars = [char for char in chars
+                             if char not in (curses.KEY_RESIZE,
+                                             curses.KEY_CLEAR)]
+                if (await self.menu.handle_keypresses(chars)):
+                    break
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+        self.renderer.cancel()
+        await self.menu.cleanup()
+        await self.details.cleanup()
+        await self.overview.cleanup()
 
-    @asyncio.coroutine
-    def redraw(self):
-        yield from self.menu.redraw()
-        yield from self.details.redraw()
-        self.window.refresh()
+    async def redraw(self):
+        self.window.erase()
+        self.window.noutrefresh()
+        await self.menu.redraw()
+        await self.details.redraw()
+        await self.overview.redraw()
 
-    @asyncio.coroutine
-    def _getch(self):
-        result = yield from self.cruise.loop.run_in_executor(
-            None, self.window.getch)
-        return result
+    def _read_keys(self):
+        """
+        Invoked by the event loop whenever stdin becomes readable. Reads all
+        keys that are available without blocking and queues them as a single
+        batch.
+        """
+        chars = []
+        char = self.window.getch()
+        while char != -1:
+            chars.append(char)
+            char = self.window.getch()
+        if chars:
+            self.keys.put_nowait(chars)
 
 
-def launch(cruise):
+def launch(cruise, fps=20):
     def main(window):
-        MainWindow(cruise, window).run()
+        MainWindow(cruise, window, fps).run()
     curses.wrapper(main)
@@ -27,107 +27,527 @@
 
 import click
 import asyncio
-from score.init import parse_config_file, init as score_init
+import datetime
+import functools
+import json
+import signal
+import sys
+import time
+from collections import OrderedDict
+from score.init import (
+    parse_config_file, parse_host_port, parse_time_interval,
+    init as score_init)
 
 
 @click.group('cruise', invoke_without_command=True)
+@click.option('--direct', is_flag=True,
+              help='Connect to the monitors directly, even if an agent is '
+              'running')
+@click.option('--fps', type=float, default=20,
+              help='Maximum screen updates per second of the interactive '
+              'interface')
 @click.pass_context
-def main(clickctx):
+def main(clickctx, direct, fps):
+    clickctx.meta['score.cruise.direct'] = direct
     if clickctx.invoked_subcommand:
         return
     from .curses import launch
-    launch(_init(clickctx))
+    launch(_init(clickctx), fps)
 
 
 @main.command('list')
+@click.option('--timeout', type=float,
+              help='Seconds to wait for each server to respond')
+@click.option('--concurrency', type=int,
+              help='Maximum number of servers to query at once')
+@click.option('--stream', is_flag=True,
+              help='Print each server as soon as its status arrives')
+@click.option('--max-age', type=float,
+              help='Maximum age of cached statuses in seconds')
 @click.pass_context
-def list(clickctx):
+def list(clickctx, timeout, concurrency, stream, max_age):
     """
     Lists running processes of all servers
     """
     cruise = _init(clickctx)
-    coroutines = []
-    for server in cruise.servers:
-        coroutines.append(server.get_status())
-    for server, coroutine in zip(cruise.servers, coroutines):
-        status = cruise.loop.run_until_complete(coroutine)
-        status_lines = []
+    callback = None
+    if stream:
+        callback = _print_server_status
+    statuses = cruise.run(cruise.get_statuses(
+        timeout=timeout, concurrency=concurrency, max_age=max_age,
+        callback=callback))
+    if not stream:
+        for server, status in statuses.items():
+            _print_server_status(server, status)
+
+
+def _print_server_status(server, status):
+    status_lines = []
+    if isinstance(status, str):
+        status_lines.append('<%s>' % (status,))
+    else:
+        for service, state in status.items():
+            status_lines.append('%s: %s' % (service, state))
+    if server.latency is not None:
+        status_lines.append('(latency: %.1fms)' % (server.latency * 1000,))
+    line_length = max(len(line) for line in status_lines)
+    tpl = '{:^%d}' % (line_length + 2)
+    print(tpl.format(server.name))
+    print('-' * (line_length + 2))
+    for line in status_lines:
+        print(' ' + line)
+    print('')
+    sys.stdout.flush()
+
+
+def _server_selection(func):
+    """
+    Decorator adding the arguments and options for selecting multiple servers
+    to a command.
+    """
+    func = click.argument('servers', nargs=-1)(func)
+    func = click.option('-a', '--all', 'all_', is_flag=True,
+                        help='Select all configured servers')(func)
+    func = click.option('-E', '--regex', is_flag=True,
+                        help='Interpret SERVERS as regular expressions '
+                        'instead of shell-style wildcards')(func)
+    return func
+
+
+def _parallelism(func):
+    """
+    Decorator adding options for contacting multiple servers concurrently.
+    """
+    func = click.option('-j', '--parallel', type=int,
+                        help='Maximum number of servers to contact at once')(
+                            func)
+    func = click.option('--timeout', type=float,
+                        help='Seconds to wait for each server')(func)
+    return func
+
+
+def _confirmation(func):
+    """
+    Decorator adding an option for waiting until servers confirm a command.
+    """
+    return click.option(
+        '-w', '--wait', type=float, metavar='SECONDS',
+        help='Wait up to SECONDS for each server to reach the requested '
+        'state')(func)
+
+
+@main.command('restart')
+@_server_selection
+@_parallelism
+@_confirmation
+@click.pass_context
+def restart(clickctx, servers, all_, regex, parallel, timeout, wait):
+    """
+    Restarts servers
+    """
+    _run_command(
+        clickctx, 'restart', servers, all_, regex, parallel, timeout, wait)
+
+
+@main.command('stop')
+@_server_selection
+@_parallelism
+@_confirmation
+@click.pass_context
+def stop(clickctx, servers, all_, regex, parallel, timeout, wait):
+    """
+    Stops servers
+    """
+    _run_command(
+        clickctx, 'stop', servers, all_, regex, parallel, timeout, wait)
+
+
+@main.command('status')
+@_server_selection
+@_parallelism
+@click.option('--max-age', type=float,
+              help='Maximum age of cached statuses in seconds')
+@click.pass_context
+def status(clickctx, servers, all_, regex, parallel, timeout, max_age):
+    """
+    Prints the status of servers
+    """
+    cruise = _init(clickctx)
+    servers = _select_servers(cruise, servers, all_, regex)
+    statuses = cruise.run(cruise.get_statuses(
+        servers, timeout=timeout, concurrency=parallel, max_age=max_age))
+    if len(statuses) == 1:
+        status = next(iter(statuses.values()))
         if isinstance(status, str):
-            status_lines.append('<%s>' % (status,))
+            print(status)
         else:
             for service, state in status.items():
-                status_lines.append('%s: %s' % (service, state))
-        line_length = max(len(line) for line in status_lines)
-        tpl = '{:^%d}' % (line_length + 2)
-        print(tpl.format(server.name))
-        print('-' * (line_length + 2))
-        for line in status_lines:
-            print(' ' + line)
-        print('')
-    _cleanup_loop(cruise.loop)
+                print('%s: %s' % (service, state))
+    else:
+        for server, status in statuses.items():
+            _print_server_status(server, status)
+    if any(isinstance(status, str) for status in statuses.values()):
+        clickctx.exit(1)
 
 
-@main.command('restart')
-@click.argument('server')
+@main.command('wait')
+@_server_selection
+@click.option('--state', default='running',
+              help='State all services must reach, defaults to running')
+@click.option('--timeout', type=float,
+              help='Maximum number of seconds to wait, defaults to no limit')
+@click.pass_context
+def wait(clickctx, servers, all_, regex, state, timeout):
+    """
+    Waits until all services of servers are in a state
+    """
+    cruise = _init(clickctx)
+    servers = _select_servers(cruise, servers, all_, regex)
+
+    def print_result(server, result):
+        if isinstance(result, Exception):
+            print('%s: timeout' % (server.name,))
+        else:
+            print('%s: %s after %.1fs' % (server.name, state, result))
+        sys.stdout.flush()
+    results = cruise.run(cruise.wait_for_state(
+        state, servers, timeout=timeout, callback=print_result))
+    if any(isinstance(result, Exception) for result in results.values()):
+        clickctx.exit(1)
+
+
+@main.command('rolling-restart')
+@_server_selection
+@click.option('-b', '--batch', default='1',
+              help='Number or percentage of servers to restart at once, '
+              'i.e. 5 or 20%')
+@click.option('--deadline', type=float, default=60,
+              help='Seconds each batch may take to recover')
+@click.option('--stop-failed', is_flag=True,
+              help='Stop the servers of a batch that failed to recover')
 @click.pass_context
-def restart(clickctx, server):
+def rolling_restart(clickctx, servers, all_, regex, batch, deadline,
+                    stop_failed):
     """
-    Restarts a server
+    Restarts servers in batches, waiting for each batch to recover
     """
+    from .._init import _parse_batch_size
     cruise = _init(clickctx)
-    server = _get_server(cruise, server)
+    servers = _select_servers(cruise, servers, all_, regex)
     try:
-        cruise.loop.run_until_complete(server.restart())
-    except ConnectionRefusedError:
-        raise click.ClickException('Server not running')
-    _cleanup_loop(cruise.loop)
+        batch = _parse_batch_size(batch, len(servers))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--batch')
 
+    def print_result(server, result):
+        print('%s: %s' % (server.name, result))
+        sys.stdout.flush()
+    results = cruise.run(cruise.rolling_restart(
+        servers, batch_size=batch, deadline=deadline,
+        stop_failed=stop_failed, callback=print_result))
+    if any(result != 'ok' for result in results.values()):
+        clickctx.exit(1)
 
-@main.command('stop')
-@click.argument('server')
+
+@main.command('agent')
+@click.option('--socket', 'path',
+              help='Path of the unix socket to listen on, overrides the '
+              'configured agent.socket')
 @click.pass_context
-def stop(clickctx, server):
+def agent(clickctx, path):
     """
-    Restarts a server
+    Keeps connections to all monitors open for other cruise commands
     """
+    from ..agent import Agent
+    cruise = _init(clickctx, direct=True)
+    path = path or cruise.agent_socket
+    if not path:
+        raise click.UsageError(
+            'No socket configured, set agent.socket or use --socket')
+    agent = Agent(cruise, path)
+
+    async def serve():
+        await agent.start()
+        try:
+            await cruise.serve_metrics()
+            await _wait_for_termination(cruise.loop)
+        finally:
+            await agent.stop()
+    try:
+        cruise.run(serve())
+    except (RuntimeError, OSError) as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command('gateway')
+@click.option('--listen',
+              help='The host:port to listen on, overrides the configured '
+              'gateway.listen')
+@click.pass_context
+def gateway(clickctx, listen):
+    """
+    Serves the status of all servers to dashboards over HTTP
+    """
+    from ..gateway import Gateway
+    cruise = _init(clickctx, direct=True)
+    if listen:
+        try:
+            address = parse_host_port(listen)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--listen')
+    elif cruise.gateway_listen:
+        address = cruise.gateway_listen
+    else:
+        raise click.UsageError(
+            'No address configured, set gateway.listen or use --listen')
+    gateway = Gateway(cruise, *address)
+
+    async def serve():
+        await gateway.start()
+        try:
+            await cruise.serve_metrics()
+            await _wait_for_termination(cruise.loop)
+        finally:
+            await gateway.stop()
+    try:
+        cruise.run(serve())
+    except OSError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command('history')
+@_server_selection
+@click.option('--since', default='1h',
+              help='Time interval to inspect, i.e. 30m or 1d')
+@click.option('--service', 'services', multiple=True,
+              help='Only inspect given service, may be passed multiple times')
+@click.option('--transitions', 'query', flag_value='transitions',
+              default=True, help='List state transitions (default)')
+@click.option('--flaps', 'query', flag_value='flaps',
+              help='Count state transitions per service')
+@click.option('--state', 'query', flag_value='time_in_state',
+              help='Show the time each service spent in its current state')
+@click.option('--uptime', 'query', flag_value='uptime',
+              help='Show the fraction of time all services were running')
+@click.pass_context
+def history(clickctx, servers, all_, regex, since, services, query):
+    """
+    Shows recorded state transitions of servers
+    """
+    from ..agent import AgentConnector
     cruise = _init(clickctx)
-    server = _get_server(cruise, server)
+    if not servers:
+        servers = cruise.servers
+    else:
+        servers = _select_servers(cruise, servers, all_, regex)
+    if not all(isinstance(server, AgentConnector) for server in servers):
+        raise click.ClickException(
+            'The history is recorded by the cruise agent, which is not running')
     try:
-        cruise.loop.run_until_complete(server.stop())
-    except ConnectionRefusedError:
-        raise click.ClickException('Server not running')
-    _cleanup_loop(cruise.loop)
+        since = time.time() - parse_time_interval(since)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--since')
+    kwargs = {'services': services or None}
+    if query in ('transitions', 'flaps', 'uptime'):
+        kwargs['since'] = since
+    results = cruise.run(cruise.query_history(query, servers, **kwargs))
+    for server, result in results.items():
+        if query == 'transitions':
+            for timestamp, service, state in result:
+                print('%s %s %s: %s' % (
+                    datetime.datetime.fromtimestamp(timestamp).strftime(
+                        '%Y-%m-%d %H:%M:%S'),
+                    server.name, service, state))
+        elif query == 'flaps':
+            for service, count in result.items():
+                print('%s %s: %d' % (server.name, service, count))
+        elif query == 'time_in_state':
+            for service, (state, seconds) in result.items():
+                print('%s %s: %s for %s' % (
+                    server.name, service, state,
+                    datetime.timedelta(seconds=int(seconds))))
+        elif result is None:
+            print('%s: unknown' % (server.name,))
+        else:
+            print('%s: %.2f%%' % (server.name, result * 100))
 
 
-@main.command('status')
-@click.argument('server')
+@main.command('watch')
+@_server_selection
+@click.option('--service', 'services', multiple=True,
+              help='Only report given service, may be passed multiple times')
+@click.option('--snapshot', is_flag=True,
+              help='Report the initial state of every service, too')
 @click.pass_context
-def status(clickctx, server):
+def watch(clickctx, servers, all_, regex, services, snapshot):
     """
-    Restarts a server
+    Prints status changes of servers as JSON lines
+
+    Every line is an object with the keys "time", "server", "service", "old"
+    and "new". The latter two are the states of the service before and after
+    the change, or null if the service was added or removed. A server that
+    stops reporting its services, like one going offline, gets a line for
+    each of its services with the server's status (i.e. "offline") as the
+    new state, and the same status as the old state once it reports them
+    again. Changes between such statuses without any known services are
+    reported with a null service.
     """
+    from ..service import diff_status
     cruise = _init(clickctx)
-    server = _get_server(cruise, server)
-    status = cruise.loop.run_until_complete(server.get_status())
-    if isinstance(status, str):
-        print(status)
+    if not servers:
+        servers = cruise.servers
     else:
-        for service, state in status.items():
-            print('%s: %s' % (service, state))
-    _cleanup_loop(cruise.loop)
+        servers = _select_servers(cruise, servers, all_, regex)
+    services = frozenset(services)
+    writer = _LineWriter(cruise.loop, sys.stdout)
 
+    def status_changed(server, status):
+        old = seen.get(server)
+        seen[server] = status
+        if old is None and not snapshot:
+            return
+        now = time.time()
 
-def _get_server(cruise, name):
+        def write(service, old_state, state):
+            if service is None or not services or service in services:
+                writer.write(_watch_line(
+                    now, server, service, old_state, state))
+        if isinstance(status, str):
+            if isinstance(old, dict) and old:
+                for service, state in old.items():
+                    write(service, state, status)
+            elif old != status:
+                write(None, old, status)
+            return
+        if isinstance(old, str):
+            for service, state in status.items():
+                write(service, old, state)
+            return
+        delta = diff_status(old, status)
+        for service, state in delta.added.items():
+            write(service, None, state)
+        for service, (old_state, state) in delta.changed.items():
+            write(service, old_state, state)
+        for service, old_state in delta.removed.items():
+            write(service, old_state, None)
+
+    seen = {}
+
+    async def stream():
+        callbacks = []
+        for server in servers:
+            callback = functools.partial(status_changed, server)
+            callbacks.append((server, callback))
+            server.add_status_change_callback(callback)
+        try:
+            await _wait_for_termination(cruise.loop, writer)
+        finally:
+            for server, callback in callbacks:
+                server.remove_status_change_callback(callback)
+            writer.flush()
     try:
-        return next(server for server in cruise.servers if server.name == name)
-    except StopIteration:
+        cruise.run(stream())
+    except KeyboardInterrupt:
+        pass
+
+
+def _watch_line(timestamp, server, service, old, new):
+    return json.dumps(OrderedDict((
+        ('time', round(timestamp, 3)),
+        ('server', server.name),
+        ('service', service),
+        ('old', old),
+        ('new', new),
+    )), separators=(',', ':'))
+
+
+class _LineWriter:
+    """
+    Collects lines and writes them to a *stream* once per iteration of the
+    event *loop*, so bursts of changes cost a single write and flush.
+    """
+
+    def __init__(self, loop, stream):
+        self.loop = loop
+        self.stream = stream
+        self.lines = []
+        self.scheduled = False
+        self.on_error = None
+
+    def write(self, line):
+        self.lines.append(line)
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.lines:
+            return
+        lines, self.lines = self.lines, []
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except BrokenPipeError:
+            # the consumer went away, there is nobody left to report to
+            self.lines = []
+            if self.on_error:
+                self.on_error()
+
+
+def _run_command(clickctx, command, patterns, all_, regex, parallel,
+                 timeout, wait):
+    cruise = _init(clickctx)
+    servers = _select_servers(cruise, patterns, all_, regex)
+
+    def print_result(server, result):
+        if result is None:
+            print('%s: ok' % (server.name,))
+        elif isinstance(result, float):
+            print('%s: ok (%.1fs)' % (server.name, result))
+        elif isinstance(result, ConnectionRefusedError):
+            print('%s: failed (server not running)' % (server.name,))
+        elif isinstance(result, asyncio.TimeoutError):
+            print('%s: failed (timeout)' % (server.name,))
+        else:
+            print('%s: failed (%s)' % (server.name, result))
+        sys.stdout.flush()
+    results = cruise.run(cruise.run_command(
+        command, servers, timeout=timeout, concurrency=parallel, wait=wait,
+        callback=print_result))
+    failed = [server for server, result in results.items()
+              if isinstance(result, Exception)]
+    if len(servers) > 1:
+        print('%d/%d succeeded' % (len(servers) - len(failed), len(servers)))
+    if failed:
+        clickctx.exit(1)
+
+
+def _select_servers(cruise, patterns, all_=False, regex=False):
+    if all_:
+        return cruise.servers
+    if not patterns:
+        raise click.UsageError('No servers given, use --all to select all')
+    servers = cruise.select_servers(patterns, regex=regex)
+    if not servers:
         raise click.ClickException(
-            'No server called `%s` found in score.cruise configuration' %
-            (name,))
+            'No server matching `%s` found in score.cruise configuration' %
+            ('`, `'.join(patterns),))
+    return servers
 
 
-def _init(clickctx):
+def _init(clickctx, direct=False):
     conf = parse_config_file(clickctx.obj['conf'].path)
+    direct = direct or clickctx.meta.get('score.cruise.direct', False)
+    if not direct and 'cruise' in conf:
+        from ..agent import init_client
+        cruise = init_client(dict(conf['cruise']))
+        if cruise is not None:
+            return cruise
     overrides = {
         'score.init': {
             'modules': 'score.cruise',
@@ -144,13 +564,19 @@ def _init(clickctx):
     return score_init(conf, overrides=overrides).cruise
 
 
-def _cleanup_loop(loop):
-    pending_tasks = [t for t in asyncio.Task.all_tasks(loop)
-                     if not t.done()]
-    while pending_tasks:
-        loop.run_until_complete(pending_tasks[0])
-        pending_tasks = [t for t in asyncio.Task.all_tasks(loop)
-                         if not t.done()]
+async def _wait_for_termination(loop, writer=None):
+    """
+    Waits until the process receives SIGTERM, or until the consumer of the
+    optional *writer* went away.
+    """
+    terminated = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, terminated.set)
+    if writer is not None:
+        writer.on_error = terminated.set
+    try:
+        await terminated.wait()
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
 
 
 if __name__ == '__main__':
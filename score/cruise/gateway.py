@@ -0,0 +1,255 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+A long-running process holding a single connection to every configured
+monitor, which serves the aggregated status of all servers to any number of
+dashboards. The load on the monitors thus no longer depends on the number of
+viewers.
+
+The gateway answers the following HTTP requests:
+
+``GET /status``
+    A JSON object containing the ``version`` of the snapshot and the
+    ``servers``, mapping each server name to its status. The status is
+    either an object mapping service names to their states, a string like
+    ``offline``, or `null` if the monitor has not responded yet.
+
+``GET /status/<server>``
+    The status of a single server.
+
+``GET /events``
+    A WebSocket, which receives the current snapshot as a ``snapshot``
+    message, followed by a ``delta`` message for every change.
+
+Both status resources carry an ``ETag`` and are answered with ``304 Not
+Modified``, if the request's ``If-None-Match`` header matches it.
+
+A delta message contains the ``version`` of the snapshot after the change
+and maps each affected server to the ``added`` and ``changed`` services and
+their new states, and the names of the ``removed`` services. Servers that
+stopped reporting services, like those going offline, contain their new
+``status`` instead, and list all their services as ``added`` once they
+report services again. Deltas are merged if a client cannot keep up with the
+changes.
+"""
+
+import functools
+import json
+import time
+from collections import OrderedDict
+
+from .hub import EventHub
+from .service import merge_deltas
+from ._http import Response, accept_websocket, serve
+
+
+class Gateway:
+    """
+    Serves the statuses of the servers of given :class:`ConfiguredCruiseModule`
+    *cruise* on *host* and *port*. Every WebSocket client may have up to
+    *queue_size* deltas queued, before they are merged.
+    """
+
+    def __init__(self, cruise, host, port, *, queue_size=100):
+        self.cruise = cruise
+        self.loop = cruise.loop
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.servers = OrderedDict(
+            (server.name, server) for server in cruise.servers)
+        self.statuses = OrderedDict(
+            (server.name, server.status) for server in cruise.servers)
+        self.version = 0
+        # the version of each server's last change
+        self.versions = dict.fromkeys(self.servers, 0)
+        self.hub = EventHub(self.loop, 'gateway', coalesce=_merge_changes)
+        self.websockets = set()
+        # distinguishes the etags of different gateway processes
+        self._epoch = '%x' % int(time.time())
+        self._callbacks = OrderedDict()
+        self._pending = None
+        self._body = None
+        self._server = None
+
+    async def start(self):
+        for server in self.cruise.servers:
+            callback = functools.partial(self._delta_received, server)
+            self._callbacks[server] = callback
+            server.add_status_delta_callback(callback)
+        self._server = await serve(self.host, self.port, self.handle)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for websocket in list(self.websockets):
+            websocket.close(1001)
+        for server, callback in self._callbacks.items():
+            server.remove_status_delta_callback(callback)
+        self._callbacks.clear()
+
+    def _delta_received(self, server, delta):
+        self.version += 1
+        self.versions[server.name] = self.version
+        self.statuses[server.name] = delta.new
+        self._body = None
+        # deltas arriving in the same iteration of the loop, like after a
+        # network outage, are sent to the clients as a single message
+        if self._pending is None:
+            self._pending = OrderedDict()
+            self.loop.call_soon(self._publish)
+        older = self._pending.get(server.name)
+        if older is not None:
+            delta = merge_deltas(older, delta)
+        self._pending[server.name] = delta
+
+    def _publish(self):
+        pending, self._pending = self._pending, None
+        self.hub.publish((self.version, pending))
+
+    @property
+    def etag(self):
+        """
+        The ``ETag`` of the current snapshot.
+        """
+        return '"%s-%x"' % (self._epoch, self.version)
+
+    @property
+    def body(self):
+        """
+        The current snapshot encoded as JSON. It is encoded only once per
+        version, no matter how many clients request it.
+        """
+        if self._body is None:
+            self._body = _encode({
+                'version': self.version,
+                'servers': self.statuses,
+            })
+        return self._body
+
+    async def handle(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return Response(405)
+        path = request.path.split('?')[0].rstrip('/')
+        if path == '/events':
+            return (await self._stream(request))
+        if path == '/status':
+            return _conditional(request, self.etag, lambda: self.body)
+        prefix, _, name = path.rpartition('/')
+        if prefix != '/status' or name not in self.servers:
+            return Response(404)
+        etag = '"%s-%x"' % (self._epoch, self.versions[name])
+        return _conditional(
+            request, etag, lambda: _encode(self.statuses[name]))
+
+    async def _stream(self, request):
+        websocket = accept_websocket(request)
+        if websocket is None:
+            return Response(426, {'Upgrade': 'websocket'})
+        version = self.version
+        websocket.send(str(_encode({
+            'type': 'snapshot',
+            'version': version,
+            'servers': self.statuses,
+        }), 'UTF-8'))
+
+        async def send(event):
+            if websocket.closed:
+                return
+            version, deltas = event
+            websocket.send(str(_encode({
+                'type': 'delta',
+                'version': version,
+                'servers': OrderedDict(
+                    (name, _encode_delta(delta))
+                    for name, delta in deltas.items()),
+            }), 'UTF-8'))
+            try:
+                await websocket.drain()
+            except ConnectionError:
+                websocket.close()
+
+        def skip_known(event):
+            # changes made before the snapshot are already part of it
+            return event if event[0] > version else None
+        self.hub.subscribe(send, maxsize=self.queue_size, policy='coalesce',
+                           transform=skip_known)
+        self.websockets.add(websocket)
+        try:
+            while (await websocket.receive()) is not None:
+                pass
+        finally:
+            self.websockets.discard(websocket)
+            self.hub.unsubscribe(send)
+            websocket.close()
+
+
+def _conditional(request, etag, body):
+    """
+    Returns a :class:`Response` with given *etag*, which only contains the
+    *body* if the client does not have it already. The *body* is a callable
+    returning the encoded body.
+    """
+    headers = OrderedDict([
+        ('ETag', etag),
+        ('Cache-Control', 'no-cache'),
+    ])
+    matches = request.headers.get('if-none-match', '')
+    if matches == '*' or etag in (tag.strip() for tag in matches.split(',')):
+        return Response(304, headers)
+    headers['Content-Type'] = 'application/json'
+    return Response(200, headers, body())
+
+
+def _merge_changes(older, newer):
+    """
+    Merges two queued events, each consisting of a version and a dict mapping
+    server names to their :class:`StatusDelta`.
+    """
+    version, deltas = newer
+    merged = OrderedDict(older[1])
+    for name, delta in deltas.items():
+        if name in merged:
+            delta = merge_deltas(merged[name], delta)
+        merged[name] = delta
+    return version, merged
+
+
+def _encode_delta(delta):
+    if not isinstance(delta.new, dict):
+        return {'status': delta.new}
+    return {
+        'added': delta.added,
+        'removed': list(delta.removed),
+        'changed': OrderedDict(
+            (service, new) for service, (old, new) in delta.changed.items()),
+    }
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':')).encode('UTF-8')
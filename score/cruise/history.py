@@ -0,0 +1,244 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+import time
+from array import array
+from collections import OrderedDict
+
+
+class Interner:
+    """
+    Assigns consecutive integer ids to strings.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def id(self, value):
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+            return self.ids[value]
+
+    def value(self, id):
+        return self.values[id]
+
+
+service_names = Interner()
+state_names = Interner()
+
+
+def _fit(array_, value):
+    """
+    Returns *array_*, or a copy of it with a wider typecode, if it cannot hold
+    the unsigned integer *value*.
+    """
+    if value < 1 << (8 * array_.itemsize):
+        return array_
+    for typecode in 'BHILQ':
+        if value < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, array_)
+    raise OverflowError('%d does not fit into an array' % (value,))
+
+
+class StatusHistory:
+    """
+    A ring buffer containing the last *size* state transitions of the
+    services of a server.
+
+    Each transition is stored in three parallel arrays: the time in tenths of
+    a second since the creation of the history, the id of the service and the
+    id of the state. Service names and state names are interned in the
+    module-level :class:`Interner` objects :data:`service_names` and
+    :data:`state_names`, which are shared by all histories. The arrays of the
+    ids start with the smallest item sizes and every array is widened once a
+    value no longer fits into it. The arrays grow as transitions are
+    recorded, until they reach *size* entries, after which the oldest
+    transition is overwritten.
+
+    Services that are no longer present are recorded with the state the
+    server transitioned to (i.e. ``offline``), or the state ``removed``, if
+    the server still reports other services.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.base = time.time()
+        self._times = array('I')
+        self._services = array('H')
+        self._states = array('B')
+        self._next = 0
+
+    def __len__(self):
+        return len(self._times)
+
+    def record(self, service, state, timestamp=None):
+        """
+        Adds a transition of a *service* to a *state* at given *timestamp*,
+        which defaults to the current time.
+        """
+        if self.size < 1:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        values = (
+            max(0, int(round((timestamp - self.base) * 10))),
+            service_names.id(service),
+            state_names.id(state),
+        )
+        # widen all arrays before modifying any of them, to keep them aligned
+        arrays = self._times, self._services, self._states = tuple(
+            _fit(array_, value)
+            for array_, value in zip(
+                (self._times, self._services, self._states), values))
+        if len(self._times) < self.size:
+            for array_, value in zip(arrays, values):
+                array_.append(value)
+            return
+        for array_, value in zip(arrays, values):
+            array_[self._next] = value
+        self._next = (self._next + 1) % self.size
+
+    def record_delta(self, delta, timestamp=None):
+        """
+        Records all transitions described by given
+        :class:`score.cruise.service.StatusDelta`.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        for service, state in delta.added.items():
+            self.record(service, state, timestamp)
+        for service, (_, state) in delta.changed.items():
+            self.record(service, state, timestamp)
+        removed_state = delta.new if isinstance(delta.new, str) else 'removed'
+        for service in delta.removed:
+            self.record(service, removed_state, timestamp)
+
+    def _entry(self, index):
+        index = (self._next + index) % len(self._times)
+        return (self.base + self._times[index] / 10,
+                service_names.value(self._services[index]),
+                state_names.value(self._states[index]))
+
+    def __iter__(self):
+        for index in range(len(self._times)):
+            yield self._entry(index)
+
+    def __reversed__(self):
+        for index in reversed(range(len(self._times))):
+            yield self._entry(index)
+
+    def transitions(self, since=None, until=None, services=None):
+        """
+        Returns a list of all transitions between the timestamps *since* and
+        *until* as 3-tuples containing the timestamp, the service name and
+        the state. The list can be limited to given *services*.
+        """
+        result = []
+        for timestamp, service, state in reversed(self):
+            if since is not None and timestamp < since:
+                break
+            if until is not None and timestamp > until:
+                continue
+            if services is not None and service not in services:
+                continue
+            result.append((timestamp, service, state))
+        result.reverse()
+        return result
+
+    def flaps(self, since=None, services=None):
+        """
+        Counts the transitions of each service since given timestamp.
+        """
+        counts = OrderedDict()
+        for _, service, _ in self.transitions(since, services=services):
+            counts[service] = counts.get(service, 0) + 1
+        return counts
+
+    def time_in_state(self, services=None, now=None):
+        """
+        Returns an OrderedDict mapping the name of each service to a 2-tuple
+        containing its current state and the number of seconds it has been in
+        that state.
+        """
+        if now is None:
+            now = time.time()
+        result = OrderedDict()
+        for timestamp, service, state in reversed(self):
+            if service in result:
+                continue
+            if services is not None and service not in services:
+                continue
+            result[service] = (state, now - timestamp)
+        return OrderedDict(
+            (service, value) for service, value in reversed(result.items())
+            if value[0] != 'removed')
+
+    def uptime(self, since, until=None, services=None):
+        """
+        Returns the fraction of the time between the timestamps *since* and
+        *until* during which all (given) services were running. The result
+        will be `None` if the history contains no information about this
+        period.
+        """
+        if until is None:
+            until = time.time()
+        current = {}
+        start = None
+        clock = since
+        up = 0
+
+        def is_up():
+            return bool(current) and all(
+                state == 'running' for state in current.values())
+        for timestamp, service, state in self:
+            if timestamp > until:
+                break
+            if services is not None and service not in services:
+                continue
+            if timestamp > since:
+                if start is None:
+                    start = since if current else timestamp
+                    clock = start
+                if is_up():
+                    up += timestamp - clock
+                clock = timestamp
+            if state == 'removed':
+                current.pop(service, None)
+            else:
+                current[service] = state
+        if start is None:
+            if not current:
+                return None
+            start = clock = since
+        if is_up():
+            up += until - clock
+        if until <= start:
+            return None
+        return up / (until - start)
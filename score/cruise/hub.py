@@ -0,0 +1,213 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+import asyncio
+import logging
+from collections import deque
+
+
+log = logging.getLogger('score.cruise')
+
+
+policies = ('drop-oldest', 'coalesce', 'block')
+
+
+class Subscription:
+    """
+    A *callback* registered with an :class:`EventHub`.
+
+    Coroutine functions receive their events through a queue holding at most
+    *maxsize* events, which is drained by a single task awaiting one
+    invocation of the *callback* at a time. The *policy* decides what
+    happens when an event arrives while the queue is full:
+
+    - ``drop-oldest`` discards the oldest queued event,
+    - ``coalesce`` merges the event with the newest queued event, using the
+      hub's *coalesce* function, and
+    - ``block`` queues the event nonetheless, but asks the hub to stop the
+      producer until the queue is drained to half its size.
+
+    All events that were discarded or merged are counted in
+    :attr:`dropped`. Plain functions are invoked immediately and never
+    queue anything. A plain function returning a coroutine will have it
+    scheduled as a task, without any bounds.
+
+    The optional *transform* is applied to every event before it is queued.
+    It may return `None` to skip the event.
+    """
+
+    def __init__(self, hub, callback, maxsize=100, policy='drop-oldest',
+                 transform=None):
+        if policy not in policies:
+            raise ValueError('Invalid policy `%s`' % (policy,))
+        self.hub = hub
+        self.callback = callback
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.transform = transform
+        self.queued = asyncio.iscoroutinefunction(callback)
+        self.queue = deque()
+        self.dropped = 0
+        self.blocking = False
+        self._task = None
+
+    def put(self, event):
+        if self.transform is not None:
+            event = self.transform(event)
+            if event is None:
+                return
+        if not self.queued:
+            # the event is published while a message from a monitor is being
+            # processed, an exception would tear down the connection
+            try:
+                result = self.callback(event)
+            except Exception:
+                log.exception('Error in subscriber of %s', self.hub.name)
+                return
+            if asyncio.iscoroutine(result):
+                self.hub.loop.create_task(result)
+            return
+        queue = self.queue
+        if len(queue) >= self.maxsize:
+            if self.policy == 'drop-oldest':
+                queue.popleft()
+                self._drop()
+            elif self.policy == 'coalesce':
+                event = self.hub.coalesce(queue.pop(), event)
+                self._drop()
+                if self.transform is not None:
+                    event = self.transform(event)
+                    if event is None:
+                        # the two events cancelled each other out
+                        return
+            elif not self.blocking:
+                self.blocking = True
+                self.hub._pressure_changed()
+        queue.append(event)
+        if self._task is None:
+            self._task = self.hub.loop.create_task(self._drain())
+
+    def _drop(self):
+        self.dropped += 1
+        self.hub.dropped += 1
+
+    def cancel(self):
+        self.queue.clear()
+        self._unblock()
+
+    def _unblock(self):
+        if self.blocking:
+            self.blocking = False
+            self.hub._pressure_changed()
+
+    async def _drain(self):
+        queue = self.queue
+        try:
+            while queue:
+                event = queue.popleft()
+                if self.blocking and len(queue) <= self.maxsize // 2:
+                    self._unblock()
+                try:
+                    await self.callback(event)
+                except Exception:
+                    log.exception('Error in subscriber of %s', self.hub.name)
+        finally:
+            self._task = None
+
+
+def _latest(old, new):
+    return new
+
+
+class EventHub:
+    """
+    Publishes events to any number of subscribers, each with its own
+    :class:`Subscription`. The *name* is used in log messages. Queued events
+    are merged with *coalesce*, which receives the older and the newer event
+    and defaults to keeping the newer one.
+
+    The *pressure_callback* is invoked without arguments whenever a
+    subscriber with the ``block`` policy starts or stops blocking. The
+    producer should stop publishing while :attr:`blocked` is `True`.
+    """
+
+    def __init__(self, loop, name, *, coalesce=_latest,
+                 pressure_callback=None):
+        self.loop = loop
+        self.name = name
+        self.coalesce = coalesce
+        self.pressure_callback = pressure_callback
+        self.subscriptions = []
+        # number of events discarded or merged for any subscriber so far
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, callback, **kwargs):
+        """
+        Registers a *callback* and returns its :class:`Subscription`. The
+        keyword arguments are passed to the constructor of the latter.
+        """
+        subscription = Subscription(self, callback, **kwargs)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, callback):
+        """
+        Removes the first subscription of given *callback* and discards all
+        its queued events. Raises `ValueError` if the callback was not
+        registered.
+        """
+        for i, subscription in enumerate(self.subscriptions):
+            if subscription.callback == callback:
+                del self.subscriptions[i]
+                subscription.cancel()
+                return
+        raise ValueError('Callback not registered')
+
+    def publish(self, event):
+        for subscription in self.subscriptions:
+            subscription.put(event)
+
+    @property
+    def blocked(self):
+        """
+        Whether any subscriber asked the producer to stop publishing.
+        """
+        return any(subscription.blocking
+                   for subscription in self.subscriptions)
+
+    @property
+    def depth(self):
+        """
+        The number of events queued for all subscribers.
+        """
+        return sum(len(subscription.queue)
+                   for subscription in self.subscriptions)
+
+    def _pressure_changed(self):
+        if self.pressure_callback is not None:
+            self.pressure_callback()
@@ -0,0 +1,272 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+Counters describing the internals of this module, exported in the text
+exposition format of Prometheus.
+
+Metrics are only collected if a :class:`Metrics` registry was configured (see
+the ``metrics.listen`` configuration key of :func:`score.cruise.init`).
+Connectors and protocols check for the presence of their metrics object
+before updating any value, so there is no cost beyond that check otherwise.
+"""
+
+import bisect
+from collections import OrderedDict
+
+from ._http import Response, serve
+
+
+default_buckets = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05,
+                   .1, .25, .5, 1, 2.5)
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge(Counter):
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield name + '_bucket', labels + (('le', str(bound)),), total
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, total
+
+
+class Family:
+    """
+    All metrics of the same *name*, distinguished by their label values.
+    """
+
+    def __init__(self, name, type, help, labelnames, factory):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.labelnames = labelnames
+        self.factory = factory
+        self.children = OrderedDict()
+
+    def labels(self, *values):
+        try:
+            return self.children[values]
+        except KeyError:
+            child = self.children[values] = self.factory()
+            return child
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.help)
+        yield '# TYPE %s %s' % (self.name, self.type)
+        for values, child in self.children.items():
+            labels = tuple(zip(self.labelnames, values))
+            for name, labels, value in child.samples(self.name, labels):
+                if labels:
+                    name += '{%s}' % ','.join(
+                        '%s="%s"' % (key, _escape(value))
+                        for key, value in labels)
+                yield '%s %s' % (name, _format(value))
+
+
+class Metrics:
+    """
+    A registry of metric families. Functions registered as *collectors* are
+    invoked before each rendering and can be used to update gauges.
+    """
+
+    def __init__(self):
+        self.families = OrderedDict()
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._family(name, 'counter', help, labelnames, Counter)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._family(name, 'gauge', help, labelnames, Gauge)
+
+    def histogram(self, name, help, labelnames=(), buckets=default_buckets):
+        return self._family(name, 'histogram', help, labelnames,
+                            lambda: Histogram(buckets))
+
+    def _family(self, name, type, help, labelnames, factory):
+        if name not in self.families:
+            self.families[name] = Family(
+                name, type, help, labelnames, factory)
+        return self.families[name]
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host, port):
+        """
+        Starts an HTTP server on *host* and *port* exporting the metrics at
+        ``/metrics``. Returns the :class:`asyncio.Server`.
+        """
+
+        def handler(request):
+            if request.path.split('?')[0] != '/metrics':
+                return Response(404)
+            if request.method not in ('GET', 'HEAD'):
+                return Response(405)
+            return Response(200, {
+                'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+            }, self.render().encode('UTF-8'))
+        return serve(host, port, handler)
+
+
+class ConnectorMetrics:
+    """
+    The metrics updated by a single connector and its protocol instances.
+    """
+
+    def __init__(self, metrics, server):
+        self.metrics = metrics
+        self.server = server
+        self.messages = metrics.counter(
+            'cruise_messages_received_total',
+            'Messages received from the monitor',
+            ('server',)).labels(server)
+        self.duplicates = metrics.counter(
+            'cruise_duplicate_messages_total',
+            'Messages identical to the previous one, which were not decoded',
+            ('server',)).labels(server)
+        self.bytes = metrics.counter(
+            'cruise_bytes_received_total',
+            'Bytes received from the monitor',
+            ('server',)).labels(server)
+        self.decode_time = metrics.histogram(
+            'cruise_json_decode_seconds',
+            'Time spent decoding status messages',
+            ('server',)).labels(server)
+        self.dispatch_time = metrics.histogram(
+            'cruise_callback_dispatch_seconds',
+            'Time spent invoking status change callbacks',
+            ('server',)).labels(server)
+        self.connect_failures = metrics.counter(
+            'cruise_connect_failures_total',
+            'Failed connection attempts',
+            ('server',)).labels(server)
+        self.reconnects = metrics.counter(
+            'cruise_reconnects_total',
+            'Connections that were lost while being used',
+            ('server',)).labels(server)
+        self._commands = metrics.counter(
+            'cruise_commands_total',
+            'Commands written to the monitor',
+            ('server', 'command'))
+        self._command_latency = metrics.histogram(
+            'cruise_command_latency_seconds',
+            'Time until the monitor confirmed a command',
+            ('server', 'command'),
+            buckets=(.1, .25, .5, 1, 2.5, 5, 10, 25, 50, 100))
+
+    def command(self, command):
+        self._commands.labels(self.server, command).inc()
+
+    def command_latency(self, command, latency):
+        self._command_latency.labels(self.server, command).observe(latency)
+
+
+def connector_collector(metrics, connectors):
+    """
+    Returns a collector updating the connection state gauges of given
+    *connectors*.
+    """
+    connected = metrics.gauge(
+        'cruise_connected', 'Whether the monitor is connected', ('server',))
+    attempts = metrics.gauge(
+        'cruise_reconnect_attempts',
+        'Consecutive failed connection attempts', ('server',))
+    delay = metrics.gauge(
+        'cruise_reconnect_delay_seconds',
+        'Delay before the next connection attempt', ('server',))
+    age = metrics.gauge(
+        'cruise_status_age_seconds',
+        'Time since the last message from the monitor', ('server',))
+    latency = metrics.gauge(
+        'cruise_latency_seconds',
+        'Moving average of the response time of the monitor', ('server',))
+    depth = metrics.gauge(
+        'cruise_subscriber_queue_depth',
+        'Events queued for slow subscribers', ('server',))
+    dropped = metrics.counter(
+        'cruise_subscriber_dropped_total',
+        'Events discarded or coalesced for slow subscribers', ('server',))
+
+    def collect():
+        for connector in connectors:
+            connected.labels(connector.name).set(int(connector.connected))
+            attempts.labels(connector.name).set(connector.reconnect_attempts)
+            delay.labels(connector.name).set(connector.reconnect_delay)
+            if connector.status_age is not None:
+                age.labels(connector.name).set(connector.status_age)
+            if connector.latency is not None:
+                latency.labels(connector.name).set(connector.latency)
+            hubs = (connector.status_hub, connector.delta_hub)
+            depth.labels(connector.name).set(sum(hub.depth for hub in hubs))
+            dropped.labels(connector.name).value = sum(
+                hub.dropped for hub in hubs)
+    return collect
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
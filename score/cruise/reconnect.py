@@ -0,0 +1,130 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+import heapq
+import itertools
+import random
+
+
+class ReconnectScheduler:
+    """
+    Schedules connection attempts of all :class:`SocketConnector` objects
+    sharing this scheduler.
+
+    Connectors that fail to connect are retried with an exponentially growing
+    delay, starting at *initial_delay* seconds and multiplied by *factor* with
+    each consecutive failure, up to a maximum of *max_delay* seconds. Each
+    delay is shortened by a random fraction of up to *jitter*, to spread out
+    the attempts of connectors that went offline at the same time.
+
+    All pending attempts are kept in a single heap, which is served by a
+    single timer on the event loop. At most *concurrency* connection attempts
+    will be in progress at any time.
+    """
+
+    def __init__(self, loop, *, initial_delay=.2, max_delay=30, factor=2,
+                 jitter=.5, concurrency=20):
+        self.loop = loop
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self._queue = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._timer = None
+
+    def backoff(self, attempts):
+        """
+        Returns the delay in seconds before the next attempt of a connector
+        that has failed to connect *attempts* times in a row.
+        """
+        delay = min(self.max_delay,
+                    self.initial_delay * self.factor ** attempts)
+        return delay * (1 - self.jitter * random.random())
+
+    def schedule(self, connector, delay=None):
+        """
+        Schedules a connection attempt of given *connector* in *delay*
+        seconds. The *delay* defaults to the :meth:`backoff` of the
+        connector. An attempt that was scheduled earlier for the same
+        connector will be replaced.
+        """
+        if delay is None:
+            delay = self.backoff(connector.reconnect_attempts)
+        connector.reconnect_delay = delay
+        entry = (self.loop.time() + delay, next(self._counter), connector)
+        self._entries[connector] = entry
+        heapq.heappush(self._queue, entry)
+        self._arm()
+
+    def cancel(self, connector):
+        """
+        Removes the scheduled connection attempt of given *connector*.
+        """
+        self._entries.pop(connector, None)
+
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue and \
+                self._entries.get(self._queue[0][2]) is not self._queue[0]:
+            heapq.heappop(self._queue)
+        if not self._queue or self.in_flight >= self.concurrency:
+            return
+        self._timer = self.loop.call_at(self._queue[0][0], self._run)
+
+    def _run(self):
+        self._timer = None
+        now = self.loop.time()
+        while self._queue and self.in_flight < self.concurrency:
+            entry = self._queue[0]
+            if self._entries.get(entry[2]) is not entry:
+                heapq.heappop(self._queue)
+                continue
+            if entry[0] > now:
+                break
+            heapq.heappop(self._queue)
+            del self._entries[entry[2]]
+            self.in_flight += 1
+            self.loop.create_task(self._attempt(entry[2]))
+        self._arm()
+
+    async def _attempt(self, connector):
+        try:
+            if connector.connected or not connector.subscribed:
+                return
+            try:
+                await connector._get_connection()
+            except OSError:
+                if connector.subscribed:
+                    self.schedule(connector)
+        finally:
+            self.in_flight -= 1
+            self._arm()
@@ -26,182 +26,790 @@
 
 import abc
 import asyncio
+import functools
 import json
-from collections import OrderedDict
+import logging
+import socket
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from .hub import EventHub
+
+
+log = logging.getLogger('score.cruise')
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#: The name of the module used by :func:`decode_json`.
+json_backend = 'json' if orjson is None else 'orjson'
+
+
+if orjson is not None:
+    decode_json = orjson.loads
+else:
+    def decode_json(message):
+        """
+        Decodes a JSON *message* given as `bytes`. Uses :mod:`orjson`, if it
+        is installed, which is considerably faster than the :mod:`json`
+        module of the standard library.
+        """
+        return json.loads(message, object_pairs_hook=OrderedDict)
+
+
+class StatusDelta(namedtuple('StatusDelta',
+                             ('old', 'new', 'added', 'removed', 'changed'))):
+    """
+    The difference between two statuses *old* and *new* of a server:
+
+    - *added* maps the names of new services to their state,
+    - *removed* maps the names of services that are no longer present to
+      their last known state and
+    - *changed* maps the names of services that changed their state to a
+      2-tuple containing the old and the new state.
+
+    A status that is a string (like ``offline``) contains no services.
+    """
+
+    __slots__ = ()
+
+    @property
+    def services(self):
+        """
+        The names of all services affected by this delta.
+        """
+        return self.added.keys() | self.removed.keys() | self.changed.keys()
+
+    def filter(self, services):
+        """
+        Returns a new delta containing only the given *services*, or `None` if
+        none of these services were affected.
+        """
+        added = OrderedDict(
+            (k, v) for k, v in self.added.items() if k in services)
+        removed = OrderedDict(
+            (k, v) for k, v in self.removed.items() if k in services)
+        changed = OrderedDict(
+            (k, v) for k, v in self.changed.items() if k in services)
+        if not added and not removed and not changed:
+            return None
+        return StatusDelta(self.old, self.new, added, removed, changed)
+
+
+def diff_status(old, new):
+    """
+    Computes the :class:`StatusDelta` between the statuses *old* and *new*.
+    """
+    old_services = old if isinstance(old, dict) else {}
+    new_services = new if isinstance(new, dict) else {}
+    added = OrderedDict()
+    changed = OrderedDict()
+    for service, state in new_services.items():
+        try:
+            old_state = old_services[service]
+        except KeyError:
+            added[service] = state
+            continue
+        if old_state != state:
+            changed[service] = (old_state, state)
+    removed = OrderedDict(
+        (service, state) for service, state in old_services.items()
+        if service not in new_services)
+    return StatusDelta(old, new, added, removed, changed)
+
+
+def merge_deltas(older, newer):
+    """
+    Merges two consecutive deltas into a single :class:`StatusDelta`
+    describing the changes from the old status of the *older* delta to the
+    new status of the *newer* one.
+    """
+    return diff_status(older.old, newer.new)
+
+
+def _filter_delta(services, delta):
+    return delta.filter(services)
+
+
+def all_in_state(status, state):
+    """
+    Whether *status* contains at least one service and all services are in
+    given *state*.
+    """
+    return (isinstance(status, dict) and bool(status) and
+            all(value == state for value in status.values()))
+
+
+class PendingCommand:
+    """
+    A *command* that was sent to a monitor, but was not confirmed yet. The
+    :attr:`future` resolves to the number of seconds it took until the
+    monitor reported the expected state.
+
+    A command is confirmed as soon as all services are in the state the
+    command should lead to. A ``restart`` additionally requires the server to
+    leave the ``running`` state first.
+    """
+
+    targets = {
+        'start': 'running',
+        'pause': 'paused',
+        'stop': 'stopped',
+        'restart': 'running',
+    }
+
+    def __init__(self, command, loop):
+        self.command = command
+        self.future = loop.create_future()
+        self.sent = loop.time()
+        self.left_state = command != 'restart'
+
+    def check(self, status):
+        """
+        Whether given *status* confirms this command.
+        """
+        if status is None:
+            # an unknown status is no evidence of the server leaving a state
+            return False
+        if all_in_state(status, self.targets[self.command]):
+            return self.left_state
+        self.left_state = True
+        return False
 
 
 class ServeConnector(metaclass=abc.ABCMeta):
+    """
+    Controls a ``score.serve`` instance called *name*.
+
+    The coroutines :meth:`start`, :meth:`pause`, :meth:`stop` and
+    :meth:`restart` return as soon as the command was sent. Their return value
+    is a future, which resolves once the server has reached the state the
+    command should lead to.
+    """
 
     def __init__(self, name, loop):
         self.name = name
         self.loop = loop
-        self.status_change_callbacks = []
+        self.status = None
+        self.status_hub = EventHub(
+            loop, name, pressure_callback=self._pressure_changed)
+        self.delta_hub = EventHub(
+            loop, name, coalesce=merge_deltas,
+            pressure_callback=self._pressure_changed)
+        self.history = None
+        self.latency = None
 
     @abc.abstractmethod
-    @asyncio.coroutine
-    def start(self):
+    async def start(self):
         pass
 
     @abc.abstractmethod
-    @asyncio.coroutine
-    def pause(self):
+    async def pause(self):
         pass
 
     @abc.abstractmethod
-    @asyncio.coroutine
-    def stop(self):
+    async def stop(self):
         pass
 
     @abc.abstractmethod
-    @asyncio.coroutine
-    def restart(self):
+    async def restart(self):
         pass
 
     @abc.abstractmethod
-    @asyncio.coroutine
-    def get_status(self):
+    async def get_status(self, max_age=None):
         pass
 
-    def add_status_change_callback(self, callback):
-        self.status_change_callbacks.append(callback)
+    async def query_history(self, query, **kwargs):
+        """
+        Invokes the method called *query* of this connector's
+        :class:`score.cruise.history.StatusHistory` with given keyword
+        arguments and returns the result.
+        """
+        if query not in ('transitions', 'flaps', 'time_in_state', 'uptime'):
+            raise ValueError('Invalid history query `%s`' % (query,))
+        if self.history is None:
+            raise ValueError('No history recorded for %s' % (self.name,))
+        return getattr(self.history, query)(**kwargs)
+
+    async def wait_for(self, predicate, timeout=None):
+        """
+        Waits until *predicate* returns a true value for the status of the
+        server and returns that status. The *predicate* is tested against the
+        current status and every status change reported afterwards, so the
+        server is never polled. Raises :class:`asyncio.TimeoutError` if the
+        condition does not hold within *timeout* seconds.
+        """
+        future = self.loop.create_future()
+
+        def check(status):
+            if future.done():
+                return
+            try:
+                if predicate(status):
+                    future.set_result(status)
+            except Exception as e:
+                future.set_exception(e)
+        self.add_status_change_callback(check)
+        try:
+            if self.status is not None:
+                check(self.status)
+            return (await asyncio.wait_for(future, timeout))
+        finally:
+            self.remove_status_change_callback(check)
+
+    @property
+    def subscribed(self):
+        """
+        Whether any status change or status delta callbacks are registered.
+        """
+        return bool(self.status_hub or self.delta_hub)
+
+    def add_status_change_callback(self, callback, **kwargs):
+        """
+        Registers a *callback* that will receive the new status on each status
+        change. Coroutine functions receive their statuses through a bounded
+        queue, the keyword arguments *maxsize* and *policy* configure it as
+        described in :class:`score.cruise.hub.Subscription`.
+        """
+        self.status_hub.subscribe(callback, **kwargs)
+        self._subscriber_added()
 
     def remove_status_change_callback(self, callback):
-        self.status_change_callbacks.remove(callback)
+        self.status_hub.unsubscribe(callback)
+        self._subscriber_removed()
+
+    def add_status_delta_callback(self, callback, services=None, **kwargs):
+        """
+        Registers a *callback* that will receive a :class:`StatusDelta` on each
+        status change. If an iterable of *services* is given, the callback
+        will only be invoked if any of these services is affected, and will
+        only receive the part of the delta describing these services. The
+        keyword arguments are the same as those of
+        :meth:`add_status_change_callback`, queued deltas are coalesced by
+        merging them.
+        """
+        transform = None
+        if services is not None:
+            transform = functools.partial(_filter_delta, frozenset(services))
+        self.delta_hub.subscribe(callback, transform=transform, **kwargs)
+        self._subscriber_added()
+
+    def remove_status_delta_callback(self, callback):
+        self.delta_hub.unsubscribe(callback)
+        self._subscriber_removed()
+
+    def _subscriber_added(self):
+        pass
 
+    def _subscriber_removed(self):
+        pass
 
-class SocketConnector(ServeConnector):
+    def _pressure_changed(self):
+        """
+        Invoked whenever a subscriber starts or stops blocking, see
+        :attr:`EventHub.blocked <score.cruise.hub.EventHub.blocked>`.
+        """
+
+    def _status_change(self, status):
+        if self.status == status:
+            return
+        old, self.status = self.status, status
+        self._status_changed(old, status)
+        self.status_hub.publish(status)
+        if not self.delta_hub and self.history is None:
+            return
+        delta = diff_status(old, status)
+        if self.history is not None:
+            self.history.record_delta(delta)
+        self.delta_hub.publish(delta)
 
-    def __init__(self, name, loop, host, port):
+    def _status_changed(self, old, status):
+        """
+        Invoked on every status change, before any callbacks.
+        """
+
+
+class SocketConnector(ServeConnector):
+    """
+    Controls the server of a ``score.serve`` monitor listening on *host* and
+    *port*.
+
+    Connection attempts are abandoned after *connect_timeout* seconds, if
+    given, just like attempts that were refused.
+
+    TCP keepalive probes are sent after *keepalive* seconds without traffic,
+    if given. The connection is additionally checked every
+    *heartbeat_interval* seconds: the *heartbeat_command* is sent to the
+    monitor, if configured, and the connection is closed, if the monitor did
+    not send anything for *max_silence* seconds. This detects connections
+    that were silently lost, which would otherwise keep reporting the last
+    known status.
+
+    The :attr:`latency` is a moving average of the times it took the monitor
+    to respond after connecting and after each heartbeat command.
+    """
+
+    def __init__(self, name, loop, host, port, *, max_message_size=None,
+                 scheduler=None, status_ttl=None, metrics=None,
+                 keepalive=None, heartbeat_interval=None,
+                 heartbeat_command=None, max_silence=None,
+                 connect_timeout=None):
         super().__init__(name, loop)
         self.host = host
         self.port = port
-        self.status = None
+        self.max_message_size = max_message_size
+        self.status_ttl = status_ttl
+        self.status_received = None
+        self.metrics = metrics
+        self.command_latencies = deque(maxlen=100)
+        if scheduler is None:
+            from .reconnect import ReconnectScheduler
+            scheduler = ReconnectScheduler(loop)
+        self.scheduler = scheduler
+        self.reconnect_attempts = 0
+        self.reconnect_delay = 0
+        self.reconnects = 0
+        self.connect_timeout = connect_timeout
         self._connection = None
-        self._connect_loop_running = False
-
-    @asyncio.coroutine
-    def start(self):
-        yield from self._send_command('start')
-
-    @asyncio.coroutine
-    def pause(self):
-        yield from self._send_command('pause')
-
-    @asyncio.coroutine
-    def stop(self):
-        yield from self._send_command('stop')
-
-    @asyncio.coroutine
-    def restart(self):
-        yield from self._send_command('restart')
-
-    @asyncio.coroutine
-    def _send_command(self, command):
-        connection = yield from self._get_connection()
+        self._protocol = None
+        self._connecting = None
+        self._refreshing = None
+        self._message_waiters = []
+        self._pending_commands = deque()
+        self._last_message = None
+        self.keepalive = keepalive
+        self.heartbeat_command = heartbeat_command
+        self.max_silence = max_silence
+        if heartbeat_command and max_silence is None and heartbeat_interval:
+            self.max_silence = heartbeat_interval * 3
+        if max_silence and heartbeat_interval is None:
+            heartbeat_interval = max_silence / 2
+        self.heartbeat_interval = heartbeat_interval
+        self._heard = None
+        self._probe_sent = None
+        self._heartbeat_handle = None
+        self._reading_paused = False
+
+    async def start(self):
+        return (await self._send_command('start'))
+
+    async def pause(self):
+        return (await self._send_command('pause'))
+
+    async def stop(self):
+        return (await self._send_command('stop'))
+
+    async def restart(self):
+        return (await self._send_command('restart'))
+
+    async def _send_command(self, command):
+        connection = await self._get_connection()
+        while self.status_received is None:
+            # the status the monitor sends after accepting a connection
+            # predates the command and must not be mistaken for its result
+            await self._next_message()
+            connection = await self._get_connection()
+        pending = PendingCommand(command, self.loop)
+        self._pending_commands.append(pending)
         connection.write(command.encode('ASCII') + b'\n')
-
-    @asyncio.coroutine
-    def get_status(self):
-        if self.status is not None:
+        if self.metrics is not None:
+            self.metrics.command(command)
+        self._check_commands(self.status)
+        return pending.future
+
+    def _check_commands(self, status):
+        """
+        Resolves the futures of all pending commands confirmed by given
+        *status*. Every command is checked on its own, so a command the
+        monitor ignores does not hold up the confirmation of later ones.
+        """
+        commands = self._pending_commands
+        for pending in list(commands):
+            if pending.future.done():
+                # the caller is no longer interested in this command
+                commands.remove(pending)
+                continue
+            if not pending.check(status):
+                continue
+            commands.remove(pending)
+            latency = self.loop.time() - pending.sent
+            self.command_latencies.append((pending.command, latency))
+            if self.metrics is not None:
+                self.metrics.command_latency(pending.command, latency)
+            pending.future.set_result(latency)
+
+    async def get_status(self, max_age=None):
+        """
+        Returns the status of the server. The last status received from the
+        monitor is returned, if it is at most *max_age* seconds old, which
+        defaults to the connector's :attr:`status_ttl`. Otherwise the status
+        will be :meth:`refreshed <refresh>`.
+        """
+        if max_age is None:
+            max_age = self.status_ttl
+        if self._is_fresh(max_age):
             return self.status
-        result = None
-        condition = asyncio.Condition(loop=self.loop)
-
-        @asyncio.coroutine
-        def callback(status):
-            nonlocal result
-            result = status
-            with (yield from condition):
-                condition.notify()
-        self.add_status_change_callback(callback)
+        return (await self.refresh())
+
+    @property
+    def status_age(self):
+        """
+        Seconds since the last message from the monitor, or `None` if no
+        message was received yet.
+        """
+        if self.status_received is None:
+            return None
+        return self.loop.time() - self.status_received
+
+    def _is_fresh(self, max_age):
+        if self.status is None:
+            return False
+        if self.status == 'offline':
+            # the scheduler takes care of reconnecting, as long as there are
+            # callbacks. otherwise we need to reconnect ourselves.
+            return self.subscribed
+        return max_age is None or self.status_age <= max_age
+
+    async def refresh(self):
+        """
+        Replaces the connection to the monitor with a new one and returns the
+        status the monitor sends after connecting. Concurrent calls will share
+        a single refresh.
+        """
+        if self._refreshing is None:
+            self._refreshing = self.loop.create_task(self._refresh())
+        return (await asyncio.shield(self._refreshing))
+
+    async def _refresh(self):
         try:
-            yield from self._get_connection()
-            with (yield from condition):
-                yield from condition.wait_for(lambda: result is not None)
-            return result
-        except (ConnectionError, ConnectionRefusedError):
-            return 'offline'
+            if self._protocol is not None and self.status_received is not None:
+                self._protocol.abandon()
+                self._connection = self._protocol = None
+            received = self._next_message()
+            try:
+                await self._get_connection()
+                await received
+            except OSError:
+                # either the connection attempt failed, or the connection was
+                # lost before the monitor sent its status
+                if self.subscribed:
+                    self.scheduler.schedule(self)
+                return 'offline'
+            finally:
+                if received in self._message_waiters:
+                    self._message_waiters.remove(received)
+            return self.status
         finally:
-            self.remove_status_change_callback(callback)
-
-    @asyncio.coroutine
-    def _get_connection(self):
-        if self._connection is None:
-            connection = yield from self._connect()
-        elif asyncio.iscoroutine(self._connection):
-            connection = (yield from self._connection)[0]
-        else:
-            connection = self._connection
-        return connection
-
-    @asyncio.coroutine
-    def _connect(self):
-        self._connection = self.loop.create_connection(
-            lambda: ServeProtocol(self), self.host, self.port)
+            self._refreshing = None
+
+    def _next_message(self):
+        """
+        Returns a future resolving once the next message from the monitor was
+        processed. It fails with a :class:`ConnectionResetError`, if the
+        connection is lost before.
+        """
+        waiter = self.loop.create_future()
+        self._message_waiters.append(waiter)
+        return waiter
+
+    @property
+    def connected(self):
+        return self._connection is not None
+
+    async def _get_connection(self):
+        """
+        Returns the transport of the connection to the monitor, establishing
+        the connection first, if necessary. Concurrent callers will share a
+        single connection attempt.
+        """
+        if self._connection is not None:
+            return self._connection
+        if self._connecting is None:
+            self._connecting = self.loop.create_task(self._connect())
+        return (await asyncio.shield(self._connecting))
+
+    async def _connect(self):
+        # the monitor sends its status right after accepting the connection,
+        # which we treat just like a response to a heartbeat. the status might
+        # even arrive before _open_connection() returns. the probes use
+        # perf_counter(), since the clock of uvloop only has a resolution of
+        # a millisecond and only advances once per iteration of the loop.
+        self._heard = self.loop.time()
+        self._probe_sent = time.perf_counter()
         try:
-            self._connection = (yield from self._connection)[0]
-        except (ConnectionError, ConnectionRefusedError):
-            self._connection = None
+            try:
+                self._connection, self._protocol = await asyncio.wait_for(
+                    self._open_connection(), self.connect_timeout)
+            except asyncio.TimeoutError:
+                # an OSError, to be handled like a refused connection by all
+                # callers. otherwise a monitor behind a host dropping packets
+                # would occupy a slot of the scheduler for minutes.
+                raise TimeoutError(
+                    'Connection to %s timed out' % (self.name,)) from None
+        except OSError:
+            self._probe_sent = None
+            self.reconnect_attempts += 1
+            if self.metrics is not None:
+                self.metrics.connect_failures.inc()
             self._status_change('offline')
             raise
+        finally:
+            self._connecting = None
+        self.reconnect_attempts = 0
+        self.reconnect_delay = 0
+        if self.keepalive:
+            _enable_keepalive(self._connection, self.keepalive)
+        self._reading_paused = False
+        self._pressure_changed()
+        if self.heartbeat_interval:
+            self._schedule_heartbeat()
         return self._connection
 
-    @asyncio.coroutine
-    def _connect_loop(self):
-        if self._connect_loop_running:
-            return
-        self._connect_loop_running = True
+    def _schedule_heartbeat(self):
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+        self._heartbeat_handle = self.loop.call_later(
+            self.heartbeat_interval, self._heartbeat)
 
-        def is_connected():
-            return (self._connection is not None and
-                    not asyncio.iscoroutine(self._connection))
-        while not is_connected() and self.status_change_callbacks:
-            try:
-                yield from self._connect()
-            except (ConnectionError, ConnectionRefusedError):
-                yield from asyncio.sleep(.2, loop=self.loop)
-        self._connect_loop_running = False
+    def _heartbeat(self):
+        self._heartbeat_handle = None
+        if self._connection is None:
+            return
+        now = self.loop.time()
+        if self._reading_paused:
+            # the monitor cannot be heard while a subscriber blocks reading
+            self._heard = now
+        elif self.max_silence and now - self._heard > self.max_silence:
+            log.warning('Closing connection to %s: no message for %.1fs',
+                        self.name, now - self._heard, extra={'server': self})
+            # abort() instead of close(), since there is no point in flushing
+            # data to a peer that does not respond.
+            self._connection.abort()
+            return
+        if self.heartbeat_command and self._probe_sent is None:
+            self._probe_sent = time.perf_counter()
+            self._connection.write(
+                self.heartbeat_command.encode('UTF-8') + b'\n')
+        self._schedule_heartbeat()
+
+    def _open_connection(self):
+        """
+        Returns a coroutine opening the connection to the monitor, which
+        resolves to a 2-tuple of transport and protocol.
+        """
+        return self.loop.create_connection(
+            self._create_protocol, self.host, self.port)
+
+    def _create_protocol(self):
+        return ServeProtocol(self, self.max_message_size, self.metrics)
 
     def _message_received(self, message):
-        self._status_change(json.loads(message, object_pairs_hook=OrderedDict))
-
-    def _status_change(self, status):
-        if self.status == status:
-            return
-        self.status = status
-        for callback in self.status_change_callbacks:
-            result = callback(status)
-            if asyncio.iscoroutine(result):
-                self.loop.create_task(result)
+        self.status_received = self._heard = self.loop.time()
+        if self._probe_sent is not None:
+            sample = time.perf_counter() - self._probe_sent
+            self._probe_sent = None
+            if self.latency is None:
+                self.latency = sample
+            else:
+                self.latency += (sample - self.latency) * .2
+        # monitors repeat their status quite often, there is no need to decode
+        # a message that is identical to the previous one.
+        if message == self._last_message:
+            if self.metrics is not None:
+                self.metrics.messages.inc()
+                self.metrics.duplicates.inc()
+        elif self.metrics is None:
+            self._last_message = message
+            self._status_change(decode_json(message))
+        else:
+            self._last_message = message
+            start = time.perf_counter()
+            status = decode_json(message)
+            self.metrics.decode_time.observe(time.perf_counter() - start)
+            self.metrics.messages.inc()
+            self._status_change(status)
+        waiters, self._message_waiters = self._message_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
 
     def _connection_lost(self):
-        self._connection = None
+        self._connection = self._protocol = None
+        self._last_message = None
+        self._probe_sent = None
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        while self._pending_commands:
+            future = self._pending_commands.popleft().future
+            if not future.done():
+                future.set_exception(ConnectionResetError(
+                    'Connection to monitor lost before command was '
+                    'confirmed'))
+        self.status_received = None
         self._status_change('offline')
-        if not self.status_change_callbacks:
+        waiters, self._message_waiters = self._message_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError(
+                    'Connection to monitor lost before it sent a message'))
+        if self.subscribed:
+            self.reconnects += 1
+            if self.metrics is not None:
+                self.metrics.reconnects.inc()
+            self.scheduler.schedule(self)
+
+    def _status_change(self, status):
+        if self.metrics is None:
+            super()._status_change(status)
             return
-        self.loop.create_task(self._connect_loop())
+        start = time.perf_counter()
+        super()._status_change(status)
+        self.metrics.dispatch_time.observe(time.perf_counter() - start)
 
-    def add_status_change_callback(self, callback):
-        super().add_status_change_callback(callback)
+    def _status_changed(self, old, status):
+        if self._pending_commands:
+            self._check_commands(status)
+
+    def _subscriber_added(self):
+        if self._connection is None and self._connecting is None:
+            self.scheduler.schedule(self, 0)
+
+    def _pressure_changed(self):
+        # stop reading from the monitor while a subscriber cannot keep up, to
+        # let the backpressure propagate to the monitor through tcp
         if self._connection is None:
-            self.loop.create_task(self._connect_loop())
+            return
+        blocked = self.status_hub.blocked or self.delta_hub.blocked
+        if blocked == self._reading_paused:
+            return
+        self._reading_paused = blocked
+        if blocked:
+            self._connection.pause_reading()
+        else:
+            self._connection.resume_reading()
+
+    def _subscriber_removed(self):
+        if not self.subscribed:
+            self.scheduler.cancel(self)
+
+
+def _enable_keepalive(transport, idle):
+    """
+    Enables TCP keepalive on the socket of given *transport*, sending the
+    first probe after *idle* seconds without traffic. The connection is
+    considered lost after three unanswered probes.
+    """
+    sock = transport.get_extra_info('socket')
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    idle = max(1, int(idle))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                        max(1, idle // 3))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+class UnixSocketConnector(SocketConnector):
+    """
+    A :class:`SocketConnector` talking to a monitor on the same host through
+    the unix domain socket at *path*.
+    """
+
+    def __init__(self, name, loop, path, **kwargs):
+        super().__init__(name, loop, None, None, **kwargs)
+        self.path = path
+
+    def _open_connection(self):
+        return self.loop.create_unix_connection(
+            self._create_protocol, self.path)
 
 
 class ServeProtocol(asyncio.Protocol):
+    """
+    Splits the data stream of a monitor connection into newline-delimited
+    messages and passes them to the *connector* as `bytes`.
+
+    Received data is appended to a single buffer, which is scanned for
+    newlines starting at the position where the previous scan ended. Processed
+    messages are only removed from the buffer once they make up at least half
+    of it, keeping the cost of each byte received constant.
 
-    def __init__(self, connector):
+    The connection will be closed, if a message exceeds *max_message_size*
+    bytes. The number of bytes received is counted in the given
+    :class:`score.cruise.metrics.ConnectorMetrics`, if present.
+    """
+
+    def __init__(self, connector, max_message_size=None, metrics=None):
         self.connector = connector
         self.loop = connector.loop
-        self.buffer = b''
+        self.max_message_size = max_message_size
+        self.metrics = metrics
+        self.transport = None
+        self.abandoned = False
+        self.buffer = bytearray()
+        # start of the first message that was not processed yet
+        self.offset = 0
+        # position in the buffer, up to which we know there is no newline
+        self.scanned = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def abandon(self):
+        """
+        Closes the connection without notifying the connector.
+        """
+        self.abandoned = True
+        self.transport.close()
 
     def data_received(self, data):
-        self.buffer += data
-        index = self.buffer.find(b'\n')
+        if self.abandoned:
+            return
+        if self.metrics is not None:
+            self.metrics.bytes.inc(len(data))
+        buffer = self.buffer
+        buffer += data
+        limit = self.max_message_size
+        offset = self.offset
+        index = buffer.find(b'\n', self.scanned)
         while index >= 0:
-            message = self.buffer[:index]
-            self.buffer = self.buffer[index + 1:]
-            self.connector._message_received(str(message, 'UTF-8'))
-            index = self.buffer.find(b'\n')
+            if limit and index - offset > limit:
+                self._close_oversized()
+                return
+            message = buffer[offset:index]
+            offset = self.offset = index + 1
+            self.connector._message_received(bytes(message))
+            index = buffer.find(b'\n', offset)
+        scanned = len(buffer)
+        if limit and scanned - offset > limit:
+            self._close_oversized()
+            return
+        if offset and offset * 2 >= scanned:
+            del buffer[:offset]
+            scanned -= offset
+            self.offset = 0
+        self.scanned = scanned
+
+    def _close_oversized(self):
+        log.warning('Closing connection to %s: message exceeds %d bytes',
+                    self.connector.name, self.max_message_size,
+                    extra={'server': self.connector})
+        self.buffer.clear()
+        self.offset = self.scanned = 0
+        self.transport.close()
 
     def connection_lost(self, exc):
-        self.connector._connection_lost()
+        if not self.abandoned:
+            self.connector._connection_lost()
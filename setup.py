@@ -43,9 +43,13 @@ setup(
     namespace_packages=['score'],
     zip_safe=False,
     license='LGPL',
+    python_requires='>=3.7',
     install_requires=[
         'score.init',
     ],
+    extras_require={
+        'uvloop': ['uvloop'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Console',
@@ -54,7 +58,11 @@ setup(
             'Public License v3 or later (LGPLv3+)',
         'Operating System :: OS Independent',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Software Development :: Libraries :: Application Frameworks',
     ],
     entry_points={